@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE, Any], Awaitable[Any]]
+Parser = Callable[[str], Any]
+
+# Upper bounds (ms) of the latency buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def int_pair(payload: str) -> Tuple[int, int]:
+	""""12_3" -> (12, 3)."""
+	a, b = payload.split("_")
+	return int(a), int(b)
+
+
+@dataclass
+class _Route:
+	name: str
+	handler: Handler
+	parse: Parser | None
+	calls: int = 0
+	errors: int = 0
+	bad_payloads: int = 0
+	total_ms: float = 0.0
+	buckets: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+
+	def observe(self, ms: float) -> None:
+		self.calls += 1
+		self.total_ms += ms
+		self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+
+	def as_dict(self) -> Dict[str, Any]:
+		labels = [f"<={b:g}" for b in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]:g}"]
+		return {
+			"calls": self.calls,
+			"errors": self.errors,
+			"bad_payloads": self.bad_payloads,
+			"avg_ms": round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+			"histogram_ms": {label: n for label, n in zip(labels, self.buckets) if n},
+		}
+
+
+class CallbackRouter:
+	"""callback_data -> handler by exact key or by prefix (payload = the rest, parsed).
+
+	Exact keys win; prefixes are looked up longest first, one dict probe per
+	distinct prefix length, so dispatch cost doesn't grow with the number of routes.
+	"""
+
+	def __init__(self) -> None:
+		self._exact: Dict[str, _Route] = {}
+		self._prefixes: Dict[str, _Route] = {}
+		self._prefix_lens: List[int] = []
+
+	def exact(self, key: str) -> Callable[[Handler], Handler]:
+		def register(handler: Handler) -> Handler:
+			self._exact[key] = _Route(key, handler, None)
+			return handler
+		return register
+
+	def prefix(self, prefix: str, parse: Parser = str) -> Callable[[Handler], Handler]:
+		def register(handler: Handler) -> Handler:
+			self._prefixes[prefix] = _Route(prefix + "*", handler, parse)
+			self._prefix_lens = sorted({len(p) for p in self._prefixes}, reverse=True)
+			return handler
+		return register
+
+	def _resolve(self, data: str) -> Tuple[_Route, str | None] | None:
+		route = self._exact.get(data)
+		if route:
+			return route, None
+		for n in self._prefix_lens:
+			route = self._prefixes.get(data[:n])
+			if route and len(data) > n:
+				return route, data[n:]
+		return None
+
+	async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE, data: str) -> bool:
+		"""Run the matching handler; False if nothing matches or the payload doesn't parse."""
+		found = self._resolve(data)
+		if found is None:
+			return False
+		route, raw = found
+		payload = None
+		if route.parse is not None:
+			try:
+				payload = route.parse(raw)
+			except (TypeError, ValueError):
+				route.bad_payloads += 1
+				logger.warning("callback %s: bad payload %r", route.name, raw)
+				return False
+		started = time.monotonic()
+		try:
+			await route.handler(update, context, payload)
+		except Exception:
+			route.errors += 1
+			raise
+		finally:
+			route.observe((time.monotonic() - started) * 1000)
+		return True
+
+	def stats(self) -> Dict[str, Any]:
+		routes = list(self._exact.values()) + list(self._prefixes.values())
+		return {r.name: r.as_dict() for r in routes if r.calls or r.bad_payloads}
@@ -1,32 +1,64 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
 import json
-import tempfile
-from pathlib import Path
 from typing import Dict, List
 import html
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode, ChatAction
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 
 from services.config import settings, assert_required_settings
 from services.logging import setup_logging
-from db.database import engine, session_scope
+from bot.update_processor import PerChatUpdateProcessor
+from bot.callback_router import CallbackRouter, int_pair
+from db.database import async_engine, async_session_scope
 from db.models import Base
-from db import repo
+from db.migrations import run_migrations
+from db import async_repo, user_cache, render_cache
+from db.user_cache import UserSnapshot
 from services.categories import build_categories
-from services.openrouter_client import chat_completion, OpenRouterError
-from services.asr_whisper import transcribe_audio, ASRUnavailable
-from services.images import get_image_url
+from services.openrouter_client import chat_completion, chat_completion_stream, OpenRouterError, close_client as close_openrouter_client, pool_stats as openrouter_pool_stats
+from services.llm_cache import stats as llm_cache_stats
+from services import transcripts
+from services import asr_engine
+from services.asr_whisper import ASRUnavailable
+from services.images import get_image_url, all_image_urls
+from services import media_cache
+from services.ratelimit import retry_after_seconds
 from services.planner import ensure_week_workouts, ensure_week_meals
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from services.reminder import setup_scheduler
+from services.write_behind import write_behind
+from services.chat_state import chat_state
+from services.outbound import outbound
 
-# In-memory store of last bot messages per chat for cleanup
-_ephemeral_messages: Dict[int, List[int]] = {}
-_hw_waiting: Dict[int, bool] = {}
+# Pending height/weight input expires if the user walks away
+_HW_WAIT_TTL_SEC = 900
+# Old screens are deleted after the next one is sent (or after this long)
+_CLEANUP_WAIT_SEC = 10.0
+_DELETE_BATCH = 100  # Bot API limit for deleteMessages
+# chat_id -> set once a new bot message is sent in the chat
+_screen_sent: Dict[int, asyncio.Event] = {}
+
+
+def _eph_key(chat_id: int) -> str:
+	"""Bot messages in this chat to delete on the next screen."""
+	return f"eph:{chat_id}"
+
+
+def _hw_key(chat_id: int) -> str:
+	return f"hw:{chat_id}"
+
+
+async def _remember_message(chat_id: int, message_id: int) -> None:
+	await chat_state.append(_eph_key(chat_id), message_id)
+	sent = _screen_sent.get(chat_id)
+	if sent:
+		sent.set()
 
 
 def format_big_message(title: str, body: str) -> str:
@@ -35,19 +67,44 @@ def format_big_message(title: str, body: str) -> str:
 
 async def on_startup() -> None:
 	if settings.feature_db:
-		Base.metadata.create_all(bind=engine)
+		async with async_engine.begin() as conn:
+			await conn.run_sync(Base.metadata.create_all)
+			await conn.run_sync(run_migrations)
 
 
 async def _cleanup_chat_messages(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
-	msg_ids = _ephemeral_messages.get(chat_id) or []
+	"""Detach the chat's old bot messages; they are deleted in the background once the next screen is up."""
+	msg_ids = await chat_state.pop(_eph_key(chat_id)) or []
 	if not msg_ids:
 		return
-	for mid in msg_ids:
-		try:
-			await context.bot.delete_message(chat_id=chat_id, message_id=mid)
-		except Exception:
-			pass
-	_ephemeral_messages[chat_id] = []
+	sent = _screen_sent.get(chat_id)
+	if sent is None or sent.is_set():
+		sent = _screen_sent[chat_id] = asyncio.Event()
+	context.application.create_task(_delete_messages_later(context.bot, chat_id, msg_ids, sent), name=f"cleanup:{chat_id}")
+
+
+async def _delete_messages_later(bot, chat_id: int, msg_ids: List[int], sent: asyncio.Event) -> None:
+	try:
+		await asyncio.wait_for(sent.wait(), _CLEANUP_WAIT_SEC)
+	except asyncio.TimeoutError:
+		pass
+	if _screen_sent.get(chat_id) is sent:
+		_screen_sent.pop(chat_id, None)
+	for i in range(0, len(msg_ids), _DELETE_BATCH):
+		batch = msg_ids[i:i + _DELETE_BATCH]
+		for attempt in range(2):
+			try:
+				await bot.delete_messages(chat_id=chat_id, message_ids=batch)
+				break
+			except RetryAfter as e:
+				if attempt:
+					logging.getLogger("ui").warning("delete_messages flood-wait in chat %s, dropping %d ids", chat_id, len(batch))
+				else:
+					await asyncio.sleep(retry_after_seconds(e))
+			except Exception as e:
+				# ids Telegram can't delete are skipped server-side; anything else loses only this batch
+				logging.getLogger("ui").warning("delete_messages failed in chat %s: %s", chat_id, e)
+				break
 
 
 async def _safe_delete_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> None:
@@ -74,6 +131,7 @@ def _main_menu_kb() -> InlineKeyboardMarkup:
 	)
 
 
+@functools.lru_cache(maxsize=None)
 def _days_kb(prefix: str) -> InlineKeyboardMarkup:
 	rows = []
 	row = []
@@ -98,19 +156,42 @@ def _workout_day_kb(plan_id: int, day_index: int) -> InlineKeyboardMarkup:
 	])
 
 
+async def _load_user(update: Update) -> UserSnapshot:
+	"""Cached snapshot of the caller's users row; creates the row on first contact."""
+	tg_user_id = str(update.effective_user.id)
+	cached = user_cache.get(tg_user_id)
+	if cached:
+		return cached
+	async with async_session_scope() as s:
+		user = await async_repo.get_or_create_user(
+			s,
+			tg_user_id=tg_user_id,
+			username=update.effective_user.username,
+			first_name=update.effective_user.first_name,
+			last_name=update.effective_user.last_name,
+		)
+	return user_cache.put(user)
+
+
+async def _update_user(update: Update, **fields) -> None:
+	async with async_session_scope() as s:
+		user = await async_repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
+		await async_repo.update_user_fields(s, user, **fields)
+
+
+async def _save_list_pref(update: Update, key: str, values: list[str]) -> None:
+	async with async_session_scope() as s:
+		user = await async_repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
+		await async_repo.set_user_list_pref(s, user, key, values)
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 	if settings.feature_db:
-		with session_scope() as s:
-			user = repo.get_or_create_user(
-				s,
-				tg_user_id=str(update.effective_user.id),
-				username=update.effective_user.username,
-				first_name=update.effective_user.first_name,
-				last_name=update.effective_user.last_name,
-			)
-			seen = repo.get_user_pref(s, user, "start_seen", False)
-			if not seen:
-				repo.set_user_pref(s, user, "start_seen", True)
+		user = await _load_user(update)
+		if not user.pref("start_seen", False):
+			async with async_session_scope() as s:
+				row = await async_repo.get_or_create_user(s, user.tg_user_id, update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
+				await async_repo.set_user_pref(s, row, "start_seen", True)
 
 	await _cleanup_chat_messages(context, update.effective_chat.id)
 	body = (
@@ -122,25 +203,26 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 	welcome = format_big_message("Привет! Я твой тренер и нутрициолог", body)
 	if settings.bot_logo_url:
 		try:
-			msg = await context.bot.send_photo(
-				chat_id=update.effective_chat.id,
-				photo=settings.bot_logo_url or get_image_url("welcome"),
+			msg = await media_cache.send_photo(
+				context.bot,
+				update.effective_chat.id,
+				settings.bot_logo_url or get_image_url("welcome"),
 				caption=welcome,
 				parse_mode=ParseMode.HTML,
 				reply_markup=_main_menu_kb(),
 			)
-			_ephemeral_messages.setdefault(update.effective_chat.id, []).append(msg.message_id)
+			await _remember_message(update.effective_chat.id, msg.message_id)
 		except Exception:
-			msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=welcome, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
-			_ephemeral_messages.setdefault(update.effective_chat.id, []).append(msg.message_id)
+			msg = await outbound.submit(context.bot.send_message, chat_id=update.effective_chat.id, text=welcome, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
+			await _remember_message(update.effective_chat.id, msg.message_id)
 	else:
 		img = get_image_url("welcome")
 		if img:
-			msg = await context.bot.send_photo(chat_id=update.effective_chat.id, photo=img, caption=welcome, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
-			_ephemeral_messages.setdefault(update.effective_chat.id, []).append(msg.message_id)
+			msg = await media_cache.send_photo(context.bot, update.effective_chat.id, img, caption=welcome, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
+			await _remember_message(update.effective_chat.id, msg.message_id)
 		else:
-			msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=welcome, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
-			_ephemeral_messages.setdefault(update.effective_chat.id, []).append(msg.message_id)
+			msg = await outbound.submit(context.bot.send_message, chat_id=update.effective_chat.id, text=welcome, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
+			await _remember_message(update.effective_chat.id, msg.message_id)
 
 	if update.message:
 		await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
@@ -152,49 +234,47 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 		"Выбери раздел ниже или отправь голос/текст. Я подберу тренировку, меню на неделю и помогу с КБЖУ.",
 	)
 	await _cleanup_chat_messages(context, update.effective_chat.id)
-	msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=_main_menu_kb(), parse_mode=ParseMode.HTML)
-	_ephemeral_messages.setdefault(update.effective_chat.id, []).append(msg.message_id)
+	msg = await outbound.submit(context.bot.send_message, chat_id=update.effective_chat.id, text=text, reply_markup=_main_menu_kb(), parse_mode=ParseMode.HTML)
+	await _remember_message(update.effective_chat.id, msg.message_id)
 	if update.message:
 		await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
 
 
-async def _reply_with_llm(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, title: str, image_topic: str | None = None, fallback_body: str | None = None) -> None:
+async def _reply_with_llm(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, title: str, image_topic: str | None = None, fallback_body: str | None = None, route: str = "chat") -> None:
 	categories = build_categories(None)
 	user = None
 	if settings.feature_db:
-		with session_scope() as s:
-			user = repo.get_or_create_user(
-				s,
-				tg_user_id=str(update.effective_user.id),
-				username=update.effective_user.username,
-				first_name=update.effective_user.first_name,
-				last_name=update.effective_user.last_name,
-			)
-			categories = build_categories(user)
+		user = await _load_user(update)
+		categories = build_categories(user)
 	await _cleanup_chat_messages(context, update.effective_chat.id)
 	await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
 	if not settings.feature_llm:
 		body = fallback_body or "LLM отключён. Включите FEATURE_LLM=1."
 		msg_text = format_big_message(title, html.escape(body))
-		msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=msg_text, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
-		_ephemeral_messages.setdefault(update.effective_chat.id, []).append(msg.message_id)
+		msg = await outbound.submit(context.bot.send_message, chat_id=update.effective_chat.id, text=msg_text, parse_mode=ParseMode.HTML, reply_markup=_main_menu_kb())
+		await _remember_message(update.effective_chat.id, msg.message_id)
 		return
 	try:
-		reply_text, usage = await chat_completion(categories, user_text)
+		streamed = settings.llm_streaming and not image_topic
+		if streamed:
+			reply_text, usage = await _stream_llm_reply(context, update.effective_chat.id, title, categories, user_text, route)
+		else:
+			reply_text, usage = await chat_completion(categories, user_text, route=route)
 		safe_body = html.escape(reply_text or "")
 		big = format_big_message(title, safe_body)
 		if settings.feature_db and user:
-			with session_scope() as s:
-				repo.add_llm_exchange(
-					s,
-					user_id=user.id,
-					provider="openrouter",
-					model=settings.openrouter_model,
-					prompt=user_text,
-					categories_json=json.dumps(categories, ensure_ascii=False),
-					response_text=reply_text,
-					usage=usage,
-				)
+			await write_behind.submit(
+				async_repo.add_llm_exchange,
+				user_id=user.id,
+				provider="openrouter",
+				model=settings.openrouter_model,
+				prompt=user_text,
+				categories_json=json.dumps(categories, ensure_ascii=False),
+				response_text=reply_text,
+				usage=usage,
+			)
+		if streamed:
+			return
 		if image_topic:
 			img = get_image_url(image_topic)
 			if img:
@@ -227,17 +307,15 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 		return
 	user_text = update.message.text.strip()
 	# Handle HW input if awaiting
-	if _hw_waiting.get(update.effective_chat.id):
+	if await chat_state.get(_hw_key(update.effective_chat.id)):
 		parts = user_text.replace(",", ".").split()
 		if len(parts) >= 2:
 			try:
 				h = int(float(parts[0]))
 				w = int(float(parts[1]))
 				if 100 <= h <= 250 and 35 <= w <= 300:
-					with session_scope() as s:
-						user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-						repo.update_user_fields(s, user, height_cm=h, weight_kg=w)
-					_hw_waiting[update.effective_chat.id] = False
+					await _update_user(update, height_cm=h, weight_kg=w)
+					await chat_state.delete(_hw_key(update.effective_chat.id))
 					await _cleanup_chat_messages(context, update.effective_chat.id)
 					await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", f"Рост: {h} см, Вес: {w} кг"), _profile_kb())
 					await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
@@ -260,11 +338,11 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 			await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
 		return
 	voice = update.message.voice
-	with tempfile.TemporaryDirectory() as td:
-		dl_path = Path(td) / f"{voice.file_unique_id}.oga"
+	text = await transcripts.get(voice.file_unique_id)
+	if text is None:
 		try:
 			file = await context.bot.get_file(voice.file_id)
-			await file.download_to_drive(custom_path=str(dl_path))
+			audio = bytes(await file.download_as_bytearray())
 		except Exception as e:
 			logging.getLogger("download").error("Failed to download voice: %s", e)
 			await help_command(update, context)
@@ -272,204 +350,210 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 				await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
 			return
 		try:
-			text, _conf = await transcribe_audio(dl_path)
+			text, _conf = await asr_engine.transcribe(audio, f"{voice.file_unique_id}.oga")
+			if not text.strip():
+				raise ASRUnavailable("empty transcript")
 		except Exception:
 			await help_command(update, context)
 			if update.message:
 				await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
 			return
-	await _reply_with_llm(update, context, text, title="Расшифровал и ответил 🎤")
+		user_id = (await _load_user(update)).id if settings.feature_db else None
+		await transcripts.put(user_id, voice.file_id, voice.file_unique_id, text, voice.duration, voice.mime_type)
+	await _reply_with_llm(update, context, text, title="Расшифровал и ответил 🎤", route="voice")
 	if update.message:
 		await _safe_delete_message(context, update.effective_chat.id, update.message.message_id)
 
 
+_callbacks = CallbackRouter()
+
+
+@_callbacks.exact("menu_profile")
+async def _cb_menu_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	await _load_user(update)
+	text = format_big_message("Личный кабинет", "Измени параметры профиля: пол, уровень, рост/вес, цели и инвентарь.")
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_text_big(context, update.effective_chat.id, text, _profile_kb())
+
+
+@_callbacks.exact("profile_sex")
+async def _cb_profile_sex(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	kb = InlineKeyboardMarkup([[InlineKeyboardButton(text="Муж", callback_data="profile_sex_set_male"), InlineKeyboardButton(text="Жен", callback_data="profile_sex_set_female")], [InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_profile")]])
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Пол", "Выбери пол"), kb)
+
+
+@_callbacks.prefix("profile_sex_set_")
+async def _cb_profile_sex_set(update: Update, context: ContextTypes.DEFAULT_TYPE, sex: str) -> None:
+	if sex not in PROFILE_SEX:
+		await help_command(update, context)
+		return
+	await _update_user(update, sex=sex)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", f"Пол: {sex}"), _profile_kb())
+
+
+@_callbacks.exact("profile_level")
+async def _cb_profile_level(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	kb = InlineKeyboardMarkup([[InlineKeyboardButton(text=lbl, callback_data=f"profile_level_set_{key}") for lbl, key in [("Новичок","beginner"),("Средний","intermediate"),("Продвинутый","advanced")]], [InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_profile")]])
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Уровень", "Выбери тренировочный уровень"), kb)
+
+
+@_callbacks.prefix("profile_level_set_")
+async def _cb_profile_level_set(update: Update, context: ContextTypes.DEFAULT_TYPE, lvl: str) -> None:
+	if lvl not in PROFILE_LEVEL:
+		await help_command(update, context)
+		return
+	await _update_user(update, level=lvl)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", f"Уровень: {lvl}"), _profile_kb())
+
+
+@_callbacks.exact("profile_hw")
+async def _cb_profile_hw(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await chat_state.set(_hw_key(update.effective_chat.id), True, ttl_sec=_HW_WAIT_TTL_SEC)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Рост/Вес", "Отправь текстом в формате: 180 75"), InlineKeyboardMarkup([[InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_profile")]]))
+
+
+@_callbacks.exact("profile_goals")
+async def _cb_profile_goals(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	user = await _load_user(update)
+	selected = set(user.pref("goals", []))
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Цели", "Выбери одну или несколько целей"), _toggle_list_kb("goals_", GOAL_CHOICES, selected))
+
+
+@_callbacks.prefix("goals_")
+async def _cb_goals_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, val: str) -> None:
+	user = await _load_user(update)
+	selected = set(user.pref("goals", []))
+	if val == "done":
+		await _save_list_pref(update, "goals", list(selected))
+		await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", "Цели сохранены"), _profile_kb())
+		return
+	if val in GOAL_CHOICES:
+		if val in selected:
+			selected.remove(val)
+		else:
+			selected.add(val)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Цели", "Выбери одну или несколько целей"), _toggle_list_kb("goals_", GOAL_CHOICES, selected))
+
+
+@_callbacks.exact("profile_eq")
+async def _cb_profile_eq(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	user = await _load_user(update)
+	selected = set(user.pref("equipment", []))
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Инвентарь", "Отметь доступный инвентарь"), _toggle_list_kb("eq_", EQUIPMENT_CHOICES, selected))
+
+
+@_callbacks.prefix("eq_")
+async def _cb_eq_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, val: str) -> None:
+	user = await _load_user(update)
+	selected = set(user.pref("equipment", []))
+	if val == "done":
+		await _save_list_pref(update, "equipment", list(selected))
+		await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", "Инвентарь сохранён"), _profile_kb())
+		return
+	if val in EQUIPMENT_CHOICES:
+		if val in selected:
+			selected.remove(val)
+		else:
+			selected.add(val)
+	await _send_text_big(context, update.effective_chat.id, format_big_message("Инвентарь", "Отметь доступный инвентарь"), _toggle_list_kb("eq_", EQUIPMENT_CHOICES, selected))
+
+
+@_callbacks.exact("menu_workouts")
+async def _cb_menu_workouts(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	# Ensure plan and show today
+	user = None
+	if settings.feature_db:
+		user = await _load_user(update)
+	if not user:
+		await help_command(update, context)
+		return
+	plan_id, today_idx = await ensure_week_workouts(user)
+	async with async_session_scope() as s:
+		day = await async_repo.get_workout_day(s, plan_id, today_idx)
+		title = day.title if day else f"День {today_idx+1}"
+		body = day.content_text if day else "Сегодня отдых/мобилити 20 мин"
+	text = format_big_message(f"Тренировки — {title}", html.escape(body))
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	img = get_image_url("workout")
+	if img:
+		ok = await _send_photo_safe(context, update.effective_chat.id, img, text if len(text) <= 1000 else "Тренировки", _days_kb("workout_day_"))
+		if ok and len(text) > 1000:
+			await _send_text_big(context, update.effective_chat.id, text, _days_kb("workout_day_"))
+			return
+	await _send_text_big(context, update.effective_chat.id, text, _days_kb("workout_day_"))
+
+
+@_callbacks.prefix("workout_day_", parse=int)
+async def _cb_workout_day(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: int) -> None:
+	user = await _load_user(update)
+	plan_id, _ = await ensure_week_workouts(user)
+	chunks, kb = await _render_plan_day("workout", plan_id, idx)
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_chunks(context, update.effective_chat.id, chunks, kb)
+
+
+@_callbacks.prefix("workout_done_", parse=int_pair)
+async def _cb_workout_done(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: tuple[int, int]) -> None:
+	plan_id, idx = payload
+	user = await _load_user(update)
+	await write_behind.submit(async_repo.mark_workout_completed, user.id, plan_id, idx)
+	await write_behind.submit(async_repo.add_loyalty_points, user.id, 10)
+	text = format_big_message("Отлично!", f"День {idx+1} отмечен как выполненный. +10 баллов 🎉")
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_text_big(context, update.effective_chat.id, text, _days_kb("workout_day_"))
+
+
+@_callbacks.exact("menu_week")
+async def _cb_menu_week(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	user = None
+	if settings.feature_db:
+		user = await _load_user(update)
+	if not user:
+		await help_command(update, context)
+		return
+	meal_plan_id, today_idx = await ensure_week_meals(user)
+	async with async_session_scope() as s:
+		day = await async_repo.get_meal_day(s, meal_plan_id, today_idx)
+		title = day.title if day else f"День {today_idx+1}"
+		body = day.content_text if day else "~2200 ккал, 3–4 приёма пищи"
+	text = format_big_message(f"Меню — {title}", html.escape(body))
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	img = get_image_url("week")
+	if img:
+		ok = await _send_photo_safe(context, update.effective_chat.id, img, text if len(text) <= 1000 else "Меню недели", _days_kb("meals_day_"))
+		if ok and len(text) > 1000:
+			await _send_text_big(context, update.effective_chat.id, text, _days_kb("meals_day_"))
+			return
+	await _send_text_big(context, update.effective_chat.id, text, _days_kb("meals_day_"))
+
+
+@_callbacks.prefix("meals_day_", parse=int)
+async def _cb_meals_day(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: int) -> None:
+	user = await _load_user(update)
+	meal_plan_id, _ = await ensure_week_meals(user)
+	chunks, kb = await _render_plan_day("meal", meal_plan_id, idx)
+	await _cleanup_chat_messages(context, update.effective_chat.id)
+	await _send_chunks(context, update.effective_chat.id, chunks, kb)
+
+
+@_callbacks.exact("menu_root")
+async def _cb_menu_root(update: Update, context: ContextTypes.DEFAULT_TYPE, _payload: None) -> None:
+	await start_command(update, context)
+
+
 async def handle_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 	query = update.callback_query
 	if not query:
 		return
 	await query.answer()
 	try:
-		data = query.data or ""
-		_ephemeral_messages.setdefault(query.message.chat_id, []).append(query.message.message_id)
-		if data == "menu_profile":
-			# Show profile menu
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-			text = format_big_message("Личный кабинет", "Измени параметры профиля: пол, уровень, рост/вес, цели и инвентарь.")
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, text, _profile_kb())
-		elif data == "profile_sex":
-			kb = InlineKeyboardMarkup([[InlineKeyboardButton(text="Муж", callback_data="profile_sex_set_male"), InlineKeyboardButton(text="Жен", callback_data="profile_sex_set_female")], [InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_profile")]])
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Пол", "Выбери пол"), kb)
-		elif data.startswith("profile_sex_set_"):
-			sex = data.split("_")[-1]
-			if sex not in PROFILE_SEX:
-				await help_command(update, context)
-				return
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				repo.update_user_fields(s, user, sex=sex)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", f"Пол: {sex}"), _profile_kb())
-		elif data == "profile_level":
-			kb = InlineKeyboardMarkup([[InlineKeyboardButton(text=lbl, callback_data=f"profile_level_set_{key}") for lbl, key in [("Новичок","beginner"),("Средний","intermediate"),("Продвинутый","advanced")]], [InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_profile")]])
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Уровень", "Выбери тренировочный уровень"), kb)
-		elif data.startswith("profile_level_set_"):
-			lvl = data.split("_")[-1]
-			if lvl not in PROFILE_LEVEL:
-				await help_command(update, context)
-				return
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				repo.update_user_fields(s, user, level=lvl)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", f"Уровень: {lvl}"), _profile_kb())
-		elif data == "profile_hw":
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			_hw_waiting[update.effective_chat.id] = True
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Рост/Вес", "Отправь текстом в формате: 180 75"), InlineKeyboardMarkup([[InlineKeyboardButton(text="⬅️ Назад", callback_data="menu_profile")]]))
-		elif data == "profile_goals":
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				prefs = json.loads(user.preferences_json or "{}")
-				selected = set(prefs.get("goals", []))
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Цели", "Выбери одну или несколько целей"), _toggle_list_kb("goals_", GOAL_CHOICES, selected))
-		elif data.startswith("goals_"):
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				prefs = json.loads(user.preferences_json or "{}")
-				selected = set(prefs.get("goals", []))
-				val = data.split("_")[-1]
-				if val == "done":
-					repo.set_user_list_pref(s, user, "goals", list(selected))
-					await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", "Цели сохранены"), _profile_kb())
-					return
-				if val in GOAL_CHOICES:
-					if val in selected:
-						selected.remove(val)
-					else:
-						selected.add(val)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Цели", "Выбери одну или несколько целей"), _toggle_list_kb("goals_", GOAL_CHOICES, selected))
-		elif data == "profile_eq":
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				prefs = json.loads(user.preferences_json or "{}")
-				selected = set(prefs.get("equipment", []))
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Инвентарь", "Отметь доступный инвентарь"), _toggle_list_kb("eq_", EQUIPMENT_CHOICES, selected))
-		elif data.startswith("eq_"):
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				prefs = json.loads(user.preferences_json or "{}")
-				selected = set(prefs.get("equipment", []))
-				val = data.split("_")[-1]
-				if val == "done":
-					repo.set_user_list_pref(s, user, "equipment", list(selected))
-					await _send_text_big(context, update.effective_chat.id, format_big_message("Готово", "Инвентарь сохранён"), _profile_kb())
-					return
-				if val in EQUIPMENT_CHOICES:
-					if val in selected:
-						selected.remove(val)
-					else:
-						selected.add(val)
-			await _send_text_big(context, update.effective_chat.id, format_big_message("Инвентарь", "Отметь доступный инвентарь"), _toggle_list_kb("eq_", EQUIPMENT_CHOICES, selected))
-		elif data == "menu_workouts":
-			# Ensure plan and show today
-			user = None
-			if settings.feature_db:
-				with session_scope() as s:
-					user = repo.get_or_create_user(
-						s,
-						tg_user_id=str(update.effective_user.id),
-						username=update.effective_user.username,
-						first_name=update.effective_user.first_name,
-						last_name=update.effective_user.last_name,
-					)
-			if not user:
-				await help_command(update, context)
-				return
-			plan_id, today_idx = await ensure_week_workouts(user)
-			with session_scope() as s:
-				day = repo.get_workout_day(s, plan_id, today_idx)
-				title = day.title if day else f"День {today_idx+1}"
-				body = day.content_text if day else "Сегодня отдых/мобилити 20 мин"
-			text = format_big_message(f"Тренировки — {title}", html.escape(body))
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			img = get_image_url("workout")
-			if img:
-				ok = await _send_photo_safe(context, update.effective_chat.id, img, text if len(text) <= 1000 else "Тренировки", _days_kb("workout_day_"))
-				if ok and len(text) > 1000:
-					await _send_text_big(context, update.effective_chat.id, text, _days_kb("workout_day_"))
-					return
-			await _send_text_big(context, update.effective_chat.id, text, _days_kb("workout_day_"))
-		elif data.startswith("workout_day_"):
-			idx = int(data.split("_")[-1])
-			user = None
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-			plan_id, _ = await ensure_week_workouts(user)
-			with session_scope() as s2:
-				day = repo.get_workout_day(s2, plan_id, idx)
-				title = day.title if day else f"День {idx+1}"
-				body = day.content_text if day else "Отдых/мобилити"
-			text = format_big_message(f"Тренировки — {title}", html.escape(body))
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, text, _workout_day_kb(plan_id, idx))
-		elif data.startswith("workout_done_"):
-			_, _, plan_id_str, idx_str = data.split("_")
-			plan_id = int(plan_id_str)
-			idx = int(idx_str)
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-				repo.mark_workout_completed(s, user.id, plan_id, idx)
-				repo.add_loyalty_points(s, user.id, 10)
-			text = format_big_message("Отлично!", f"День {idx+1} отмечен как выполненный. +10 баллов 🎉")
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, text, _days_kb("workout_day_"))
-		elif data == "menu_week":
-			user = None
-			if settings.feature_db:
-				with session_scope() as s:
-					user = repo.get_or_create_user(
-						s,
-						tg_user_id=str(update.effective_user.id),
-						username=update.effective_user.username,
-						first_name=update.effective_user.first_name,
-						last_name=update.effective_user.last_name,
-					)
-			if not user:
-				await help_command(update, context)
-				return
-			meal_plan_id, today_idx = await ensure_week_meals(user)
-			with session_scope() as s:
-				day = repo.get_meal_day(s, meal_plan_id, today_idx)
-				title = day.title if day else f"День {today_idx+1}"
-				body = day.content_text if day else "~2200 ккал, 3–4 приёма пищи"
-			text = format_big_message(f"Меню — {title}", html.escape(body))
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			img = get_image_url("week")
-			if img:
-				ok = await _send_photo_safe(context, update.effective_chat.id, img, text if len(text) <= 1000 else "Меню недели", _days_kb("meals_day_"))
-				if ok and len(text) > 1000:
-					await _send_text_big(context, update.effective_chat.id, text, _days_kb("meals_day_"))
-					return
-			await _send_text_big(context, update.effective_chat.id, text, _days_kb("meals_day_"))
-		elif data.startswith("meals_day_"):
-			idx = int(data.split("_")[-1])
-			with session_scope() as s:
-				user = repo.get_or_create_user(s, str(update.effective_user.id), update.effective_user.username, update.effective_user.first_name, update.effective_user.last_name)
-			meal_plan_id, _ = await ensure_week_meals(user)
-			with session_scope() as s2:
-				day = repo.get_meal_day(s2, meal_plan_id, idx)
-				title = day.title if day else f"День {idx+1}"
-				body = day.content_text if day else "~2200 ккал"
-			text = format_big_message(f"Меню — {title}", html.escape(body))
-			await _cleanup_chat_messages(context, update.effective_chat.id)
-			await _send_text_big(context, update.effective_chat.id, text, _days_kb("meals_day_"))
-		elif data == "menu_root":
-			await start_command(update, context)
-		else:
+		await _remember_message(query.message.chat_id, query.message.message_id)
+		if not await _callbacks.dispatch(update, context, query.data or ""):
 			await _cleanup_chat_messages(context, update.effective_chat.id)
 			await _send_text_big(context, update.effective_chat.id, format_big_message("Неизвестная команда", "Кнопка обновлена. Откройте меню и попробуйте снова."), _main_menu_kb())
 	except Exception as e:
@@ -497,22 +581,100 @@ def _split_text_chunks(text: str, limit: int = MAX_TG_TEXT) -> List[str]:
 
 
 async def _send_text_big(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup | None) -> None:
-	parts = _split_text_chunks(text)
+	await _send_chunks(context, chat_id, _split_text_chunks(text), reply_markup)
+
+
+async def _send_chunks(context: ContextTypes.DEFAULT_TYPE, chat_id: int, parts: List[str], reply_markup: InlineKeyboardMarkup | None) -> None:
 	for part in parts:
-		msg = await context.bot.send_message(chat_id=chat_id, text=part, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-		_ephemeral_messages.setdefault(chat_id, []).append(msg.message_id)
+		msg = await outbound.submit(context.bot.send_message, chat_id=chat_id, text=part, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+		await _remember_message(chat_id, msg.message_id)
+
+
+async def _render_plan_day(kind: str, plan_id: int, idx: int) -> tuple[List[str], InlineKeyboardMarkup]:
+	"""Message chunks + keyboard for a plan-day tap, from the render cache when the plan hasn't changed."""
+	key = render_cache.key(kind, plan_id, idx)
+	view = render_cache.get(key)
+	if view is not None:
+		return view
+	async with async_session_scope() as s:
+		if kind == "workout":
+			day = await async_repo.get_workout_day(s, plan_id, idx)
+		else:
+			day = await async_repo.get_meal_day(s, plan_id, idx)
+		title = day.title if day else f"День {idx+1}"
+		body = day.content_text if day else ("Отдых/мобилити" if kind == "workout" else "~2200 ккал")
+	heading = "Тренировки" if kind == "workout" else "Меню"
+	kb = _workout_day_kb(plan_id, idx) if kind == "workout" else _days_kb("meals_day_")
+	view = (_split_text_chunks(format_big_message(f"{heading} — {title}", html.escape(body))), kb)
+	if day is not None:  # placeholders aren't cached: the real row may land any moment
+		render_cache.put(key, view)
+	return view
 
 
 async def _send_photo_safe(context: ContextTypes.DEFAULT_TYPE, chat_id: int, photo_url: str, caption_html: str, reply_markup: InlineKeyboardMarkup | None) -> bool:
 	try:
-		msg = await context.bot.send_photo(chat_id=chat_id, photo=photo_url, caption=caption_html, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
-		_ephemeral_messages.setdefault(chat_id, []).append(msg.message_id)
+		msg = await media_cache.send_photo(context.bot, chat_id, photo_url, caption=caption_html, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+		await _remember_message(chat_id, msg.message_id)
 		return True
 	except Exception as e:
 		logging.getLogger("ui").warning("send_photo failed: %s", e)
 		return False
 
 
+async def _stream_llm_reply(context: ContextTypes.DEFAULT_TYPE, chat_id: int, title: str, categories: Dict, user_text: str, route: str) -> tuple[str, Dict]:
+	"""Post a placeholder, edit it as tokens arrive (throttled), finalize with the menu keyboard."""
+	loop = asyncio.get_running_loop()
+	placeholder = await outbound.submit(context.bot.send_message, chat_id=chat_id, text=format_big_message(title, "…"), parse_mode=ParseMode.HTML)
+	await _remember_message(chat_id, placeholder.message_id)
+	usage: Dict = {}
+	parts: List[str] = []
+	next_edit = loop.time() + settings.llm_stream_edit_interval_sec
+	shown = ""
+	try:
+		async for delta in chat_completion_stream(categories, user_text, route=route, usage_out=usage):
+			parts.append(delta)
+			if loop.time() < next_edit:
+				continue
+			preview = format_big_message(title, html.escape("".join(parts))) + " ▌"
+			if len(preview) > MAX_TG_TEXT:
+				# first chunk is full; the rest is sent on finalize
+				continue
+			try:
+				# progress frames are best-effort: a flood-wait just skips ahead
+				await outbound.submit(context.bot.edit_message_text, retries=0, chat_id=chat_id, message_id=placeholder.message_id, text=preview, parse_mode=ParseMode.HTML)
+				shown = preview
+			except RetryAfter as e:
+				next_edit = loop.time() + retry_after_seconds(e)
+				continue
+			except BadRequest:
+				# "message is not modified" and friends: skip this frame
+				pass
+			next_edit = loop.time() + settings.llm_stream_edit_interval_sec
+	except Exception:
+		await _safe_delete_message(context, chat_id, placeholder.message_id)
+		raise
+	reply_text = "".join(parts)
+	chunks = _split_text_chunks(format_big_message(title, html.escape(reply_text)))
+	first_kb = _main_menu_kb() if len(chunks) == 1 else None
+	if chunks[0] != shown or first_kb is not None:
+		try:
+			await outbound.submit(context.bot.edit_message_text, chat_id=chat_id, message_id=placeholder.message_id, text=chunks[0], parse_mode=ParseMode.HTML, reply_markup=first_kb)
+		except BadRequest:
+			pass
+	if len(chunks) > 1:
+		await _send_text_big(context, chat_id, "".join(chunks[1:]), _main_menu_kb())
+	return reply_text, usage
+
+
+def _log_stats() -> None:
+	logger = logging.getLogger("bot")
+	logger.info(
+		"OpenRouter pool: %s, LLM cache: %s, write-behind: %s, user cache: %s, transcripts: %s, ASR: %s, chat state: %s, media: %s, plan views: %s, outbound: %s",
+		openrouter_pool_stats(), llm_cache_stats(), write_behind.stats(), user_cache.stats(), transcripts.stats(), asr_engine.stats(), chat_state.stats(), media_cache.stats(), render_cache.stats(), outbound.stats(),
+	)
+	logger.info("Callback routes: %s", _callbacks.stats())
+
+
 async def run() -> None:
 	setup_logging(settings.log_level)
 	logger = logging.getLogger("bot")
@@ -523,13 +685,23 @@ async def run() -> None:
 		return
 
 	await on_startup()
-
-	app = ApplicationBuilder().token(settings.telegram_bot_token).build()
+	if settings.feature_db:
+		write_behind.start()
+	outbound.start()
+
+	app = (
+		ApplicationBuilder()
+		.token(settings.telegram_bot_token)
+		.concurrent_updates(PerChatUpdateProcessor(settings.update_max_running, settings.update_max_pending))
+		.build()
+	)
 	scheduler: AsyncIOScheduler | None = None
-	if settings.feature_reminder:
+	if settings.feature_reminder or settings.feature_pregen or settings.stats_log_interval_sec > 0:
 		scheduler = AsyncIOScheduler()
 		scheduler.start()
 		setup_scheduler(scheduler, app.bot, settings.reminder_hour)
+		if settings.stats_log_interval_sec > 0:
+			scheduler.add_job(_log_stats, trigger="interval", seconds=settings.stats_log_interval_sec, id="log_stats", replace_existing=True, coalesce=True)
 
 	app.add_handler(CommandHandler("start", start_command))
 	app.add_handler(CommandHandler("help", help_command))
@@ -537,17 +709,40 @@ async def run() -> None:
 	app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 	app.add_handler(MessageHandler(filters.VOICE, handle_voice))
 
-	logger.info("Bot is starting (polling)...")
+	logger.info("Bot is starting (%s)...", settings.bot_mode)
 	await app.initialize()
 	await app.start()
+	await media_cache.load()
+	if settings.media_warmup_chat_id:
+		warm_urls = all_image_urls() + ([settings.bot_logo_url] if settings.bot_logo_url else [])
+		app.create_task(media_cache.warm_up(app.bot, settings.media_warmup_chat_id, warm_urls), name="media-warmup")
 	try:
-		await app.updater.start_polling()
+		if settings.bot_mode == "webhook":
+			# Telegram sends X-Telegram-Bot-Api-Secret-Token; PTB rejects mismatches with 403
+			await app.updater.start_webhook(
+				listen=settings.webhook_listen,
+				port=settings.webhook_port,
+				url_path=settings.webhook_path,
+				webhook_url=settings.webhook_url,
+				secret_token=settings.webhook_secret,
+				max_connections=settings.webhook_max_connections,
+				allowed_updates=Update.ALL_TYPES,
+			)
+		else:
+			await app.updater.start_polling()
 		await asyncio.Event().wait()
 	finally:
+		if app.updater.running:
+			await app.updater.stop()
 		await app.stop()
 		await app.shutdown()
 		if scheduler:
 			scheduler.shutdown(wait=False)
+		await outbound.stop()
+		await write_behind.stop()
+		_log_stats()
+		await close_openrouter_client()
+		await asr_engine.close_engine()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+	"""Runs different chats in parallel, one update at a time per chat.
+
+	PTB's own semaphore (max_pending) only bounds how many updates are queued in
+	tasks; `max_running` bounds the ones actually executing. A lane is taken
+	before a running slot, so a chat with a backlog never holds slots while it
+	waits for its own previous update.
+	"""
+
+	def __init__(self, max_running: int, max_pending: int) -> None:
+		super().__init__(max(max_pending, max_running))
+		self._max_running = max_running
+		self._running = asyncio.Semaphore(max_running)
+		self._lanes: Dict[Hashable, list] = {}  # key -> [lock, holders+waiters]
+		self._active = 0
+		self._peak = 0
+		self._processed = 0
+
+	@staticmethod
+	def _lane_key(update: object) -> Hashable | None:
+		if not isinstance(update, Update):
+			return None
+		if update.effective_chat:
+			return update.effective_chat.id
+		if update.effective_user:  # inline-mode callbacks carry no chat
+			return ("user", update.effective_user.id)
+		return None
+
+	async def _run(self, coroutine: Awaitable[Any]) -> None:
+		async with self._running:
+			self._active += 1
+			self._peak = max(self._peak, self._active)
+			try:
+				await coroutine
+			finally:
+				self._active -= 1
+				self._processed += 1
+
+	async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+		key = self._lane_key(update)
+		if key is None:
+			await self._run(coroutine)
+			return
+		lane = self._lanes.setdefault(key, [asyncio.Lock(), 0])
+		lane[1] += 1
+		try:
+			async with lane[0]:
+				await self._run(coroutine)
+		finally:
+			lane[1] -= 1
+			if lane[1] == 0:
+				self._lanes.pop(key, None)
+
+	async def initialize(self) -> None:
+		pass
+
+	async def shutdown(self) -> None:
+		logger.info("Update processor: %s", self.stats())
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"max_running": self._max_running,
+			"running": self._active,
+			"peak_running": self._peak,
+			"lanes": len(self._lanes),
+			"processed": self._processed,
+		}
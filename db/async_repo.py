@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+from typing import Optional, Dict, Any, List, Tuple
+from functools import partial
+import json
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy import Integer, select, update, delete, and_, or_, exists, func, cast, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db import user_cache, render_cache
+from db.database import after_commit
+from db.models import User, Transcription, LLMRequest, LLMResponse, LLMCacheEntry, LoyaltyAccount, UserWorkoutPlan, UserWorkoutDay, MealPlan, MealDay, WorkoutCompletion, JobCheckpoint, ChatState, MediaFile
+
+# Async counterparts of db.repo for code running on the event loop; new queries go here only.
+
+
+async def get_or_create_user(session: AsyncSession, tg_user_id: str, username: str | None, first_name: str | None, last_name: str | None) -> User:
+	user = (await session.execute(select(User).where(User.tg_user_id == tg_user_id))).scalar_one_or_none()
+	if user:
+		return user
+	user = User(tg_user_id=tg_user_id, username=username, first_name=first_name, last_name=last_name)
+	session.add(user)
+	await session.flush()
+	return user
+
+
+async def add_transcription(session: AsyncSession, user_id: int, telegram_file_id: str, text: str, audio_duration_sec: int | None, format_: str | None, telegram_file_unique_id: str | None = None) -> Transcription:
+	tr = Transcription(
+		user_id=user_id,
+		telegram_file_id=telegram_file_id,
+		telegram_file_unique_id=telegram_file_unique_id,
+		text=text,
+		audio_duration_sec=audio_duration_sec or 0,
+		format=format_ or "unknown",
+	)
+	session.add(tr)
+	await session.flush()
+	return tr
+
+
+async def get_transcription_by_unique_id(session: AsyncSession, telegram_file_unique_id: str) -> Optional[Transcription]:
+	return (await session.execute(
+		select(Transcription).where(Transcription.telegram_file_unique_id == telegram_file_unique_id).order_by(Transcription.id.desc()).limit(1)
+	)).scalar_one_or_none()
+
+
+async def add_llm_exchange(session: AsyncSession, user_id: int | None, provider: str, model: str, prompt: str, categories_json: str, response_text: str, usage: Dict[str, Any] | None) -> tuple[LLMRequest, LLMResponse]:
+	req = LLMRequest(user_id=user_id, provider=provider, model=model, prompt=prompt, categories_json=categories_json)
+	session.add(req)
+	await session.flush()
+	resp = LLMResponse(request_id=req.id, content=response_text, tokens_prompt=(usage or {}).get("prompt_tokens"), tokens_completion=(usage or {}).get("completion_tokens"))
+	session.add(resp)
+	await session.flush()
+	return req, resp
+
+
+async def get_llm_cache_entry(session: AsyncSession, key: str, now_iso: str) -> Optional[LLMCacheEntry]:
+	return (await session.execute(select(LLMCacheEntry).where(and_(LLMCacheEntry.key == key, LLMCacheEntry.expires_at > now_iso)))).scalar_one_or_none()
+
+
+async def put_llm_cache_entry(session: AsyncSession, key: str, model: str, content: str, expires_at_iso: str) -> LLMCacheEntry:
+	entry = await session.merge(LLMCacheEntry(key=key, model=model, content=content, expires_at=expires_at_iso))
+	await session.flush()
+	return entry
+
+
+async def purge_llm_cache(session: AsyncSession, now_iso: str, max_rows: int) -> int:
+	"""Drop expired rows, then the soonest-expiring rows beyond `max_rows`."""
+	removed = (await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.expires_at <= now_iso))).rowcount or 0
+	total = (await session.execute(select(func.count()).select_from(LLMCacheEntry))).scalar_one()
+	if total > max_rows:
+		oldest = select(LLMCacheEntry.key).order_by(LLMCacheEntry.expires_at).limit(total - max_rows)
+		removed += (await session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(oldest)))).rowcount or 0
+	return removed
+
+
+async def set_user_pref(session: AsyncSession, user: User, key: str, value: Any) -> None:
+	try:
+		prefs = json.loads(user.preferences_json or "{}")
+	except Exception:
+		prefs = {}
+	prefs[key] = value
+	user.preferences_json = json.dumps(prefs, ensure_ascii=False)
+	session.add(user)
+	await session.flush()
+	# drop after commit, or a concurrent _load_user could re-cache the row as it was before this write
+	after_commit(session, partial(user_cache.invalidate, user.tg_user_id))
+
+
+async def set_user_list_pref(session: AsyncSession, user: User, key: str, values: list[str]) -> None:
+	await set_user_pref(session, user, key, values)
+
+
+async def update_user_fields(session: AsyncSession, user: User, **fields: Any) -> User:
+	for k, v in fields.items():
+		setattr(user, k, v)
+	session.add(user)
+	await session.flush()
+	after_commit(session, partial(user_cache.invalidate, user.tg_user_id))
+	return user
+
+
+async def add_loyalty_points(session: AsyncSession, user_id: int, delta: int) -> LoyaltyAccount:
+	acc = await session.get(LoyaltyAccount, user_id)
+	if not acc:
+		acc = LoyaltyAccount(user_id=user_id, points=0)
+		session.add(acc)
+		await session.flush()
+	acc.points = (acc.points or 0) + delta
+	session.add(acc)
+	await session.flush()
+	return acc
+
+
+async def mark_workout_completed(session: AsyncSession, user_id: int, plan_id: int, day_index: int) -> WorkoutCompletion:
+	rec = (await session.execute(select(WorkoutCompletion).where(and_(WorkoutCompletion.user_id == user_id, WorkoutCompletion.plan_id == plan_id, WorkoutCompletion.day_index == day_index)))).scalar_one_or_none()
+	if rec:
+		return rec
+	rec = WorkoutCompletion(user_id=user_id, plan_id=plan_id, day_index=day_index, status="done")
+	session.add(rec)
+	await session.flush()
+	return rec
+
+
+async def get_active_workout_plan_for_date(session: AsyncSession, user_id: int, day_str: str) -> Optional[UserWorkoutPlan]:
+	return (
+		await session.execute(
+			select(UserWorkoutPlan)
+			.where(and_(UserWorkoutPlan.user_id == user_id, UserWorkoutPlan.is_active == 1, UserWorkoutPlan.start_date <= day_str, UserWorkoutPlan.end_date >= day_str))
+			.order_by(UserWorkoutPlan.start_date.desc())
+			.limit(1)
+		)
+	).scalars().first()
+
+
+async def get_or_create_active_workout_plan(session: AsyncSession, user_id: int, start_date_str: str, end_date_str: str, expire_before_str: str | None = None) -> UserWorkoutPlan:
+	plan = (
+		await session.execute(
+			select(UserWorkoutPlan).where(
+				and_(UserWorkoutPlan.user_id == user_id, UserWorkoutPlan.start_date == start_date_str, UserWorkoutPlan.is_active == 1)
+			)
+		)
+	).scalar_one_or_none()
+	if plan:
+		return plan
+	# roll over: plans that ended before today (default: before this window) are no longer active
+	await session.execute(
+		update(UserWorkoutPlan).where(and_(UserWorkoutPlan.user_id == user_id, UserWorkoutPlan.is_active == 1, UserWorkoutPlan.end_date < (expire_before_str or start_date_str))).values(is_active=0)
+	)
+	plan = UserWorkoutPlan(user_id=user_id, start_date=start_date_str, end_date=end_date_str, is_active=1)
+	session.add(plan)
+	await session.flush()
+	return plan
+
+
+async def get_workout_day(session: AsyncSession, plan_id: int, day_index: int) -> Optional[UserWorkoutDay]:
+	return (await session.execute(select(UserWorkoutDay).where(and_(UserWorkoutDay.plan_id == plan_id, UserWorkoutDay.day_index == day_index)))).scalar_one_or_none()
+
+
+async def get_workout_days(session: AsyncSession, plan_id: int) -> Dict[int, UserWorkoutDay]:
+	"""All days of a plan in one query, keyed by day_index."""
+	rows = (await session.execute(select(UserWorkoutDay).where(UserWorkoutDay.plan_id == plan_id))).scalars()
+	return {d.day_index: d for d in rows}
+
+
+async def upsert_workout_days(session: AsyncSession, plan_id: int, days: Dict[int, Tuple[str, str]]) -> None:
+	"""Write {day_index: (title, content_text)} in a single INSERT .. ON CONFLICT DO UPDATE."""
+	if not days:
+		return
+	stmt = sqlite_insert(UserWorkoutDay).values([
+		{"plan_id": plan_id, "day_index": i, "title": title, "content_text": text} for i, (title, text) in days.items()
+	])
+	stmt = stmt.on_conflict_do_update(
+		index_elements=[UserWorkoutDay.plan_id, UserWorkoutDay.day_index],
+		set_={"title": stmt.excluded.title, "content_text": stmt.excluded.content_text},
+	)
+	await session.execute(stmt)
+	# bump after commit: a view rendered from the old rows in between would otherwise land under the new version
+	after_commit(session, partial(render_cache.invalidate, "workout", plan_id))
+
+
+async def get_active_meal_plan_for_date(session: AsyncSession, user_id: int, day_str: str) -> Optional[MealPlan]:
+	return (
+		await session.execute(
+			select(MealPlan)
+			.where(and_(MealPlan.user_id == user_id, MealPlan.is_active == 1, MealPlan.start_date <= day_str, MealPlan.end_date >= day_str))
+			.order_by(MealPlan.start_date.desc())
+			.limit(1)
+		)
+	).scalars().first()
+
+
+async def get_or_create_active_meal_plan(session: AsyncSession, user_id: int, start_date_str: str, end_date_str: str, expire_before_str: str | None = None) -> MealPlan:
+	plan = (
+		await session.execute(
+			select(MealPlan).where(and_(MealPlan.user_id == user_id, MealPlan.start_date == start_date_str, MealPlan.is_active == 1))
+		)
+	).scalar_one_or_none()
+	if plan:
+		return plan
+	# roll over: plans that ended before today (default: before this window) are no longer active
+	await session.execute(
+		update(MealPlan).where(and_(MealPlan.user_id == user_id, MealPlan.is_active == 1, MealPlan.end_date < (expire_before_str or start_date_str))).values(is_active=0)
+	)
+	plan = MealPlan(user_id=user_id, start_date=start_date_str, end_date=end_date_str, is_active=1)
+	session.add(plan)
+	await session.flush()
+	return plan
+
+
+async def get_meal_day(session: AsyncSession, meal_plan_id: int, day_index: int) -> Optional[MealDay]:
+	return (await session.execute(select(MealDay).where(and_(MealDay.meal_plan_id == meal_plan_id, MealDay.day_index == day_index)))).scalar_one_or_none()
+
+
+async def get_meal_days(session: AsyncSession, meal_plan_id: int) -> Dict[int, MealDay]:
+	"""All days of a plan in one query, keyed by day_index."""
+	rows = (await session.execute(select(MealDay).where(MealDay.meal_plan_id == meal_plan_id))).scalars()
+	return {d.day_index: d for d in rows}
+
+
+async def upsert_meal_days(session: AsyncSession, meal_plan_id: int, days: Dict[int, Tuple[str, str]]) -> None:
+	"""Write {day_index: (title, content_text)} in a single INSERT .. ON CONFLICT DO UPDATE."""
+	if not days:
+		return
+	stmt = sqlite_insert(MealDay).values([
+		{"meal_plan_id": meal_plan_id, "day_index": i, "title": title, "content_text": text} for i, (title, text) in days.items()
+	])
+	stmt = stmt.on_conflict_do_update(
+		index_elements=[MealDay.meal_plan_id, MealDay.day_index],
+		set_={"title": stmt.excluded.title, "content_text": stmt.excluded.content_text},
+	)
+	await session.execute(stmt)
+	after_commit(session, partial(render_cache.invalidate, "meal", meal_plan_id))
+
+
+async def list_users_with_expiring_plans(session: AsyncSession, cutoff_str: str, after_user_id: int, limit: int) -> List[User]:
+	"""Users (id > after_user_id, ascending) with an active workout or meal plan ending on/before cutoff
+	and no active plan of that kind starting after it, i.e. next week not generated yet."""
+	next_workouts = aliased(UserWorkoutPlan)
+	next_meals = aliased(MealPlan)
+	expiring_workouts = exists().where(and_(
+		UserWorkoutPlan.user_id == User.id,
+		UserWorkoutPlan.is_active == 1,
+		UserWorkoutPlan.end_date <= cutoff_str,
+		~exists().where(and_(next_workouts.user_id == User.id, next_workouts.is_active == 1, next_workouts.start_date > UserWorkoutPlan.end_date)),
+	))
+	expiring_meals = exists().where(and_(
+		MealPlan.user_id == User.id,
+		MealPlan.is_active == 1,
+		MealPlan.end_date <= cutoff_str,
+		~exists().where(and_(next_meals.user_id == User.id, next_meals.is_active == 1, next_meals.start_date > MealPlan.end_date)),
+	))
+	result = await session.execute(
+		select(User).where(and_(User.id > after_user_id, or_(expiring_workouts, expiring_meals))).order_by(User.id).limit(limit)
+	)
+	return list(result.scalars())
+
+
+async def list_user_timezones(session: AsyncSession) -> List[str | None]:
+	return list((await session.execute(select(User.timezone).distinct())).scalars())
+
+
+async def list_tz_chat_ids_page(session: AsyncSession, tz_name: str | None, n_slots: int, slot: int, after_user_id: int, limit: int) -> List[Tuple[int, int]]:
+	"""(users.id, chat id) pairs in one timezone bucket and jitter slot, keyset-paged by users.id."""
+	tz_clause = or_(User.timezone.is_(None), User.timezone == "") if not tz_name else User.timezone == tz_name
+	slot_clause = func.abs(cast(User.tg_user_id, Integer)) % n_slots == slot
+	rows = await session.execute(
+		select(User.id, User.tg_user_id).where(and_(User.id > after_user_id, tz_clause, slot_clause)).order_by(User.id).limit(limit)
+	)
+	return [(row_id, int(tg_id)) for row_id, tg_id in rows]
+
+
+async def get_checkpoint(session: AsyncSession, name: str) -> Optional[str]:
+	cp = await session.get(JobCheckpoint, name)
+	return cp.cursor if cp else None
+
+
+async def set_checkpoint(session: AsyncSession, name: str, cursor: str) -> None:
+	cp = await session.get(JobCheckpoint, name)
+	if cp:
+		cp.cursor = cursor
+	else:
+		session.add(JobCheckpoint(name=name, cursor=cursor))
+	await session.flush()
+
+
+async def purge_checkpoints(session: AsyncSession, updated_before_iso: str) -> int:
+	"""Drop checkpoints not touched since `updated_before_iso` (names embed the day, so they are never reused)."""
+	return (await session.execute(delete(JobCheckpoint).where(JobCheckpoint.updated_at < updated_before_iso))).rowcount or 0
+
+
+async def get_chat_state(session: AsyncSession, key: str, now: float) -> Optional[str]:
+	return (await session.execute(
+		select(ChatState.value_json).where(and_(ChatState.key == key, ChatState.expires_at > now))
+	)).scalar_one_or_none()
+
+
+async def set_chat_state(session: AsyncSession, key: str, value_json: str, expires_at: float) -> None:
+	stmt = sqlite_insert(ChatState).values(key=key, value_json=value_json, expires_at=expires_at)
+	await session.execute(stmt.on_conflict_do_update(
+		index_elements=[ChatState.key],
+		set_={"value_json": stmt.excluded.value_json, "expires_at": stmt.excluded.expires_at},
+	))
+
+
+async def append_chat_state(session: AsyncSession, key: str, item_json: str, now: float, expires_at: float) -> None:
+	"""Append to a JSON array in one statement; an expired row starts a fresh array."""
+	stmt = sqlite_insert(ChatState).values(key=key, value_json=func.json_array(func.json(item_json)), expires_at=expires_at)
+	await session.execute(stmt.on_conflict_do_update(
+		index_elements=[ChatState.key],
+		set_={
+			"value_json": case(
+				(ChatState.expires_at <= now, func.json_array(func.json(item_json))),
+				else_=func.json_insert(ChatState.value_json, "$[#]", func.json(item_json)),
+			),
+			"expires_at": expires_at,
+		},
+	))
+
+
+async def pop_chat_state(session: AsyncSession, key: str, now: float) -> Optional[str]:
+	row = (await session.execute(
+		delete(ChatState).where(ChatState.key == key).returning(ChatState.value_json, ChatState.expires_at)
+	)).first()
+	if not row or row.expires_at <= now:
+		return None
+	return row.value_json
+
+
+async def delete_chat_state(session: AsyncSession, key: str) -> None:
+	await session.execute(delete(ChatState).where(ChatState.key == key))
+
+
+async def purge_chat_state(session: AsyncSession, now: float, max_rows: int) -> int:
+	"""Drop expired rows, then the soonest-expiring rows beyond `max_rows`."""
+	removed = (await session.execute(delete(ChatState).where(ChatState.expires_at <= now))).rowcount or 0
+	total = (await session.execute(select(func.count()).select_from(ChatState))).scalar_one()
+	if total > max_rows:
+		oldest = select(ChatState.key).order_by(ChatState.expires_at).limit(total - max_rows)
+		removed += (await session.execute(delete(ChatState).where(ChatState.key.in_(oldest)))).rowcount or 0
+	return removed
+
+
+async def list_media_files(session: AsyncSession) -> Dict[str, str]:
+	return {url: file_id for url, file_id in (await session.execute(select(MediaFile.url, MediaFile.file_id))).all()}
+
+
+async def set_media_file(session: AsyncSession, url: str, file_id: str) -> None:
+	await session.merge(MediaFile(url=url, file_id=file_id))
+	await session.flush()
+
+
+async def delete_media_file(session: AsyncSession, url: str) -> None:
+	await session.execute(delete(MediaFile).where(MediaFile.url == url))
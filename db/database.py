@@ -1,9 +1,11 @@
 from __future__ import annotations
 
-from contextlib import contextmanager
-from typing import Iterator
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncIterator, Callable, Iterator
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 from services.config import settings
 
 engine = create_engine(
@@ -16,6 +18,38 @@ engine = create_engine(
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 
+def _async_url(url: str) -> str:
+	u = make_url(url)
+	if u.get_backend_name() == "sqlite" and u.get_driver_name() != "aiosqlite":
+		u = u.set(drivername="sqlite+aiosqlite")
+	return u.render_as_string(hide_password=False)
+
+
+async_engine = create_async_engine(_async_url(settings.database_url), echo=False)
+
+# expire_on_commit=False: rows are read after the scope closes (handlers, planner)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+_AFTER_COMMIT = "after_commit_callbacks"
+
+
+def after_commit(session: Session | AsyncSession, fn: Callable[[], None]) -> None:
+	"""Run `fn` once the session's transaction commits; dropped on rollback."""
+	session.info.setdefault(_AFTER_COMMIT, []).append(fn)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session) -> None:
+	for fn in session.info.pop(_AFTER_COMMIT, ()):
+		fn()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_after_commit(session: Session) -> None:
+	session.info.pop(_AFTER_COMMIT, None)
+
+
 @contextmanager
 def session_scope() -> Iterator:
 	session = SessionLocal()
@@ -26,4 +60,17 @@ def session_scope() -> Iterator:
 		session.rollback()
 		raise
 	finally:
-		session.close()
\ No newline at end of file
+		session.close()
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+	session = AsyncSessionLocal()
+	try:
+		yield session
+		await session.commit()
+	except Exception:
+		await session.rollback()
+		raise
+	finally:
+		await session.close()
\ No newline at end of file
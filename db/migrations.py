@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+_ADD_COLUMN_RE = re.compile(r"^ALTER TABLE (\w+) ADD COLUMN (\w+)\b", re.IGNORECASE)
+
+
+class MigrationError(Exception):
+	pass
+
+
+@dataclass(frozen=True)
+class Migration:
+	version: int
+	name: str
+	statements: Tuple[str, ...]
+
+	@property
+	def checksum(self) -> str:
+		return hashlib.sha256("\n".join(self.statements).encode("utf-8")).hexdigest()
+
+
+# Append-only: never edit an applied step, add a new version instead.
+# Tables themselves come from Base.metadata.create_all, which runs first.
+MIGRATIONS: List[Migration] = [
+	Migration(
+		1,
+		"plan_lookup_indexes",
+		(
+			# get_active_*_plan_for_date / get_or_create_active_*_plan / expiring-plan scan
+			"CREATE INDEX IF NOT EXISTS ix_user_workout_plans_user_active_start ON user_workout_plans (user_id, is_active, start_date)",
+			"CREATE INDEX IF NOT EXISTS ix_meal_plans_user_active_start ON meal_plans (user_id, is_active, start_date)",
+		),
+	),
+	Migration(
+		2,
+		"user_fk_indexes",
+		(
+			"CREATE INDEX IF NOT EXISTS ix_llm_requests_user_id ON llm_requests (user_id)",
+			"CREATE INDEX IF NOT EXISTS ix_llm_responses_request_id ON llm_responses (request_id)",
+			"CREATE INDEX IF NOT EXISTS ix_messages_user_id ON messages (user_id)",
+			"CREATE INDEX IF NOT EXISTS ix_transcriptions_user_id ON transcriptions (user_id)",
+			"CREATE INDEX IF NOT EXISTS ix_workout_history_user_id ON workout_history (user_id)",
+			# (user_id, plan_id, day_index) lookups already use uq_workout_completion_unique
+			"CREATE INDEX IF NOT EXISTS ix_workout_completions_plan_day ON workout_completions (plan_id, day_index)",
+		),
+	),
+	Migration(
+		3,
+		"users_timezone_index",
+		(
+			# reminder fan-out pages users per timezone bucket by id
+			"CREATE INDEX IF NOT EXISTS ix_users_timezone_id ON users (timezone, id)",
+		),
+	),
+	Migration(
+		4,
+		"transcriptions_file_unique_id",
+		(
+			# voice transcripts are reused by Telegram's stable file_unique_id
+			"ALTER TABLE transcriptions ADD COLUMN telegram_file_unique_id VARCHAR",
+			"CREATE INDEX IF NOT EXISTS ix_transcriptions_file_unique_id ON transcriptions (telegram_file_unique_id)",
+		),
+	),
+	Migration(
+		5,
+		"chat_state_expiry_index",
+		(
+			# purge_chat_state drops expired rows, then the soonest-expiring ones over the cap
+			"CREATE INDEX IF NOT EXISTS ix_chat_state_expires_at ON chat_state (expires_at)",
+		),
+	),
+	Migration(
+		6,
+		"llm_cache_expiry_index",
+		(
+			# purge_llm_cache drops expired rows, then the soonest-expiring ones over the cap
+			"CREATE INDEX IF NOT EXISTS ix_llm_cache_expires_at ON llm_cache (expires_at)",
+		),
+	),
+]
+
+
+def _column_exists(conn: Connection, table: str, column: str) -> bool:
+	return any(row[1] == column for row in conn.execute(text(f"PRAGMA table_info({table})")))
+
+
+def run_migrations(conn: Connection) -> List[int]:
+	"""Apply pending migrations on `conn` (one transaction). Returns the versions applied."""
+	conn.execute(text(
+		"CREATE TABLE IF NOT EXISTS schema_migrations ("
+		"version INTEGER PRIMARY KEY, name TEXT NOT NULL, checksum TEXT NOT NULL, applied_at TEXT NOT NULL)"
+	))
+	applied = {row[0]: row[1] for row in conn.execute(text("SELECT version, checksum FROM schema_migrations"))}
+	known = {m.version for m in MIGRATIONS}
+	unknown = sorted(set(applied) - known)
+	if unknown:
+		logger.warning("Database has migrations unknown to this build: %s", unknown)
+
+	done: List[int] = []
+	for m in sorted(MIGRATIONS, key=lambda m: m.version):
+		if m.version in applied:
+			if applied[m.version] != m.checksum:
+				raise MigrationError(f"Checksum mismatch for migration {m.version} ({m.name}); applied steps must not be edited")
+			continue
+		logger.info("Applying migration %s: %s", m.version, m.name)
+		for stmt in m.statements:
+			# SQLite has no ADD COLUMN IF NOT EXISTS; fresh databases already got it from create_all
+			add = _ADD_COLUMN_RE.match(stmt)
+			if add and _column_exists(conn, add.group(1), add.group(2)):
+				continue
+			conn.execute(text(stmt))
+		conn.execute(
+			text("INSERT INTO schema_migrations (version, name, checksum, applied_at) VALUES (:v, :n, :c, :t)"),
+			{"v": m.version, "n": m.name, "c": m.checksum, "t": datetime.utcnow().isoformat()},
+		)
+		done.append(m.version)
+	return done
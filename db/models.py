@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, CheckConstraint, UniqueConstraint
+from sqlalchemy import Column, Float, Integer, String, Text, ForeignKey, CheckConstraint, UniqueConstraint
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -57,6 +57,7 @@ class Transcription(Base):
 	id = Column(Integer, primary_key=True)
 	user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 	telegram_file_id = Column(String)
+	telegram_file_unique_id = Column(String)
 	audio_duration_sec = Column(Integer)
 	format = Column(String)
 	text = Column(Text)
@@ -90,6 +91,16 @@ class LLMResponse(Base):
 	created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
 
 
+class LLMCacheEntry(Base):
+	__tablename__ = "llm_cache"
+
+	key = Column(String, primary_key=True)
+	model = Column(String)
+	content = Column(Text)
+	created_at = Column(String, default=lambda: datetime.utcnow().isoformat())
+	expires_at = Column(String, nullable=False)
+
+
 class WorkoutHistory(Base):
 	__tablename__ = "workout_history"
 
@@ -175,4 +186,30 @@ class WorkoutCompletion(Base):
 
 	__table_args__ = (
 		UniqueConstraint("user_id", "plan_id", "day_index", name="uq_workout_completion_unique"),
-	)
\ No newline at end of file
+	)
+
+
+class JobCheckpoint(Base):
+	__tablename__ = "job_checkpoints"
+
+	name = Column(String, primary_key=True)
+	cursor = Column(String)
+	updated_at = Column(String, default=lambda: datetime.utcnow().isoformat(), onupdate=lambda: datetime.utcnow().isoformat())
+
+
+class ChatState(Base):
+	__tablename__ = "chat_state"
+
+	key = Column(String, primary_key=True)
+	value_json = Column(Text, nullable=False)
+	# unix epoch seconds, comparable across worker processes
+	expires_at = Column(Float, nullable=False)
+
+
+class MediaFile(Base):
+	__tablename__ = "media_files"
+
+	# source URL as passed to send_photo; a changed IMAGE_* override gets a fresh upload
+	url = Column(String, primary_key=True)
+	file_id = Column(String, nullable=False)
+	updated_at = Column(String, default=lambda: datetime.utcnow().isoformat(), onupdate=lambda: datetime.utcnow().isoformat())
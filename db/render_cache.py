@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import itertools
+from typing import Any, Dict, Hashable, Tuple
+
+from services.config import settings
+from services.ttl_cache import TTLCache
+
+# Ready-to-send plan-day views keyed by (kind, plan_id, day_index, version).
+# async_repo.upsert_*_days schedule invalidate() for after the commit, which moves the plan to a fresh
+# version: a view rendered from rows read before the commit lands under the old version and is never served.
+_views: TTLCache[Any] = TTLCache(settings.render_cache_max_entries, settings.render_cache_ttl_sec)
+_versions: TTLCache[int] = TTLCache(settings.render_cache_max_entries, settings.render_cache_ttl_sec)
+_counter = itertools.count(1)
+
+
+def version(kind: str, plan_id: int) -> int:
+	return _versions.get((kind, plan_id)) or 0
+
+
+def key(kind: str, plan_id: int, day_index: int) -> Tuple[Hashable, ...]:
+	"""Cache key for the plan's current version; take it before reading the rows."""
+	return (kind, plan_id, day_index, version(kind, plan_id))
+
+
+def get(k: Tuple[Hashable, ...]) -> Any:
+	return _views.get(k)
+
+
+def put(k: Tuple[Hashable, ...], view: Any) -> None:
+	_views.set(k, view)
+
+
+def invalidate(kind: str, plan_id: int) -> None:
+	_versions.set((kind, plan_id), next(_counter))
+
+
+def stats() -> Dict[str, Any]:
+	return _views.stats()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+from services.config import settings
+from services.ttl_cache import TTLCache
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+	"""Read-only copy of a users row with preferences_json already decoded."""
+
+	id: int
+	tg_user_id: str
+	username: str | None = None
+	first_name: str | None = None
+	last_name: str | None = None
+	sex: str | None = None
+	birth_date: str | None = None
+	height_cm: int | None = None
+	weight_kg: int | None = None
+	level: str | None = None
+	activity_level: str | None = None
+	injuries: str | None = None
+	allergies: str | None = None
+	diet_type: str | None = None
+	timezone: str | None = None
+	preferences: Dict[str, Any] = field(default_factory=dict)
+
+	@classmethod
+	def from_model(cls, user) -> "UserSnapshot":
+		try:
+			prefs = json.loads(user.preferences_json or "{}")
+		except Exception:
+			prefs = {}
+		return cls(
+			id=user.id,
+			tg_user_id=user.tg_user_id,
+			username=user.username,
+			first_name=user.first_name,
+			last_name=user.last_name,
+			sex=user.sex,
+			birth_date=user.birth_date,
+			height_cm=user.height_cm,
+			weight_kg=user.weight_kg,
+			level=user.level,
+			activity_level=user.activity_level,
+			injuries=user.injuries,
+			allergies=user.allergies,
+			diet_type=user.diet_type,
+			timezone=user.timezone,
+			preferences=prefs if isinstance(prefs, dict) else {},
+		)
+
+	def pref(self, key: str, default: Any = None) -> Any:
+		return self.preferences.get(key, default)
+
+
+# Keyed by Telegram id; repo writers to users call invalidate()
+_cache: TTLCache[UserSnapshot] = TTLCache(settings.user_cache_max_entries, settings.user_cache_ttl_sec)
+
+
+def get(tg_user_id: str) -> UserSnapshot | None:
+	return _cache.get(tg_user_id)
+
+
+def put(user) -> UserSnapshot:
+	snap = user if isinstance(user, UserSnapshot) else UserSnapshot.from_model(user)
+	_cache.set(snap.tg_user_id, snap)
+	return snap
+
+
+def invalidate(tg_user_id: str | None) -> None:
+	if tg_user_id:
+		_cache.invalidate(tg_user_id)
+
+
+def stats() -> Dict[str, Any]:
+	return _cache.stats()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import io
+import logging
+import multiprocessing
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+from services.config import settings
+from services import audio_prep
+from services.asr_whisper import ASRUnavailable, transcribe_audio as _remote_transcribe, close_client as _close_remote_client
+
+logger = logging.getLogger(__name__)
+
+
+class ASRBackend(ABC):
+	"""Turns one audio clip into text."""
+
+	name = "base"
+
+	@abstractmethod
+	async def transcribe(self, data: bytes, filename: str) -> tuple[str, Optional[float]]:
+		raise NotImplementedError
+
+	async def close(self) -> None:
+		return None
+
+
+class RemoteWhisperBackend(ASRBackend):
+	name = "remote"
+
+	async def transcribe(self, data: bytes, filename: str) -> tuple[str, Optional[float]]:
+		return await _remote_transcribe(data, filename)
+
+	async def close(self) -> None:
+		await _close_remote_client()
+
+
+# --- local backend: runs inside pool workers ---
+
+_worker_model = None
+_worker_language: str | None = None
+
+
+def _init_worker(model_size: str, compute_type: str, cpu_threads: int, language: str | None) -> None:
+	"""Load the model once per worker process."""
+	global _worker_model, _worker_language
+	from faster_whisper import WhisperModel
+
+	_worker_model = WhisperModel(model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+	_worker_language = language
+
+
+def _transcribe_in_worker(data: bytes) -> tuple[str, Optional[float]]:
+	segments, info = _worker_model.transcribe(io.BytesIO(data), language=_worker_language, vad_filter=True)
+	text = " ".join(seg.text.strip() for seg in segments).strip()
+	return text, getattr(info, "language_probability", None)
+
+
+class LocalWhisperBackend(ASRBackend):
+	name = "local"
+
+	def __init__(self, model_size: str, compute_type: str, workers: int, cpu_threads: int, language: str | None) -> None:
+		if importlib.util.find_spec("faster_whisper") is None:
+			raise ASRUnavailable("ASR_ENGINE=local требует пакет faster-whisper")
+		# spawn: forking a process that already runs an event loop and threads is unsafe
+		self._pool = ProcessPoolExecutor(
+			max_workers=max(1, workers),
+			mp_context=multiprocessing.get_context("spawn"),
+			initializer=_init_worker,
+			initargs=(model_size, compute_type, cpu_threads, language),
+		)
+
+	async def transcribe(self, data: bytes, filename: str) -> tuple[str, Optional[float]]:
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self._pool, _transcribe_in_worker, data)
+
+	async def close(self) -> None:
+		self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ASREngine:
+	"""Backend wrapper that tracks in-flight clips and per-clip latency."""
+
+	def __init__(self, backend: ASRBackend) -> None:
+		self.backend = backend
+		self._pending = 0
+		self._max_pending = 0
+		self._processed = 0
+		self._failed = 0
+		self._total_ms = 0.0
+		self._max_ms = 0.0
+
+	async def transcribe(self, data: bytes, filename: str = "voice.oga") -> tuple[str, Optional[float]]:
+		self._pending += 1
+		self._max_pending = max(self._max_pending, self._pending)
+		started = time.monotonic()
+		try:
+			result = await self.backend.transcribe(data, filename)
+		except Exception:
+			self._failed += 1
+			raise
+		finally:
+			self._pending -= 1
+		elapsed_ms = (time.monotonic() - started) * 1000
+		self._processed += 1
+		self._total_ms += elapsed_ms
+		self._max_ms = max(self._max_ms, elapsed_ms)
+		logger.debug("asr[%s] %d bytes in %.0f ms", self.backend.name, len(data), elapsed_ms)
+		return result
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"engine": self.backend.name,
+			"pending": self._pending,
+			"max_pending": self._max_pending,
+			"processed": self._processed,
+			"failed": self._failed,
+			"avg_ms": round(self._total_ms / self._processed, 1) if self._processed else 0.0,
+			"max_ms": round(self._max_ms, 1),
+		}
+
+
+_engine: ASREngine | None = None
+
+
+def _build_backend() -> ASRBackend:
+	if settings.asr_engine == "local":
+		return LocalWhisperBackend(
+			settings.asr_local_model,
+			settings.asr_local_compute_type,
+			settings.asr_local_workers,
+			settings.asr_local_cpu_threads,
+			settings.asr_local_language,
+		)
+	if settings.asr_engine != "remote":
+		logger.warning("Unknown ASR_ENGINE=%r, using remote", settings.asr_engine)
+	return RemoteWhisperBackend()
+
+
+def get_engine() -> ASREngine:
+	global _engine
+	if _engine is None:
+		_engine = ASREngine(_build_backend())
+	return _engine
+
+
+async def transcribe(data: bytes, filename: str = "voice.oga") -> tuple[str, Optional[float]]:
+	"""Preprocess, transcribe chunks concurrently and join them in order."""
+	engine = get_engine()
+	if not settings.asr_preprocess:
+		return await engine.transcribe(data, filename)
+	try:
+		chunks = await asyncio.to_thread(audio_prep.preprocess, data)
+	except audio_prep.AudioPrepError as e:
+		logger.warning("audio preprocessing failed, sending raw clip: %s", e)
+		return await engine.transcribe(data, filename)
+	if not chunks:
+		return "", None
+
+	sem = asyncio.Semaphore(max(1, settings.asr_chunk_concurrency))
+
+	async def _one(i: int, chunk: bytes) -> tuple[str, Optional[float]]:
+		async with sem:
+			return await engine.transcribe(chunk, f"chunk{i}.wav")
+
+	results = await asyncio.gather(*(_one(i, c) for i, c in enumerate(chunks)))
+	text = " ".join(t.strip() for t, _ in results if t and t.strip())
+	confs = [c for _, c in results if c is not None]
+	return text, (sum(confs) / len(confs) if confs else None)
+
+
+async def close_engine() -> None:
+	global _engine
+	if _engine is not None:
+		await _engine.backend.close()
+	_engine = None
+
+
+def stats() -> Dict[str, Any]:
+	return _engine.stats() if _engine else {"engine": settings.asr_engine, "processed": 0}
@@ -1,9 +1,9 @@
 from __future__ import annotations
 
 import logging
-from pathlib import Path
 from typing import Optional
 
+import httpx
 from openai import AsyncOpenAI
 from services.config import settings
 
@@ -14,19 +14,43 @@ class ASRUnavailable(Exception):
 	pass
 
 
-async def transcribe_audio(file_path: Path) -> tuple[str, Optional[float]]:
+_client: AsyncOpenAI | None = None
+
+
+def get_client() -> AsyncOpenAI:
+	"""One long-lived Whisper client with its own keep-alive pool."""
+	global _client
+	if _client is None:
+		_client = AsyncOpenAI(
+			api_key=settings.openai_api_key,
+			http_client=httpx.AsyncClient(
+				timeout=httpx.Timeout(settings.asr_timeout_sec),
+				limits=httpx.Limits(
+					max_connections=settings.asr_max_connections,
+					max_keepalive_connections=settings.asr_max_connections,
+				),
+			),
+		)
+	return _client
+
+
+async def close_client() -> None:
+	global _client
+	if _client is not None:
+		await _client.close()
+	_client = None
+
+
+async def transcribe_audio(data: bytes, filename: str = "voice.oga") -> tuple[str, Optional[float]]:
 	if not settings.openai_api_key:
 		raise ASRUnavailable("Отсутствует OPENAI_API_KEY для Whisper")
 
-	client = AsyncOpenAI(api_key=settings.openai_api_key)
 	model = settings.whisper_model or "whisper-1"
-
-	# OpenAI expects a real file handle
-	with open(file_path, "rb") as f:
-		result = await client.audio.transcriptions.create(
-			model=model,
-			file=f,
-		)
-		text = getattr(result, "text", None) or result.get("text", "")  # type: ignore[attr-defined]
-		confidence = None
-		return text, confidence
\ No newline at end of file
+	# (name, bytes): the extension tells the API the container format; nothing touches disk
+	result = await get_client().audio.transcriptions.create(
+		model=model,
+		file=(filename, data),
+	)
+	text = getattr(result, "text", None) or result.get("text", "")  # type: ignore[attr-defined]
+	confidence = None
+	return text, confidence
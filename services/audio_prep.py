@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import io
+import logging
+import re
+import wave
+from typing import List, Tuple
+
+import ffmpeg
+
+from services.config import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+_BYTES_PER_SEC = SAMPLE_RATE * 2  # s16le mono
+
+_SILENCE_START_RE = re.compile(r"silence_start: (-?[\d.]+)")
+_SILENCE_END_RE = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+class AudioPrepError(Exception):
+	pass
+
+
+def _run(stream, data: bytes) -> tuple[bytes, bytes]:
+	try:
+		return stream.run(cmd=settings.ffmpeg_bin, input=data, capture_stdout=True, capture_stderr=True, quiet=True)
+	except ffmpeg.Error as e:
+		raise AudioPrepError((e.stderr or b"").decode("utf-8", "replace")[-500:]) from e
+	except FileNotFoundError as e:
+		raise AudioPrepError(f"{settings.ffmpeg_bin} not found") from e
+
+
+def to_pcm(data: bytes) -> bytes:
+	"""Decode any container to 16 kHz mono s16le with leading/trailing silence trimmed."""
+	threshold = f"{settings.asr_silence_db}dB"
+	stream = ffmpeg.input("pipe:0")
+	# trailing trim = leading trim on the reversed signal
+	for _ in range(2):
+		stream = stream.filter("silenceremove", start_periods=1, start_threshold=threshold, start_silence=0.1).filter("areverse")
+	out, _ = _run(stream.output("pipe:1", format="s16le", acodec="pcm_s16le", ac=1, ar=SAMPLE_RATE), data)
+	return out
+
+
+def find_silences(pcm: bytes) -> List[Tuple[float, float]]:
+	"""(start, end) seconds of pauses inside the clip."""
+	stream = (
+		ffmpeg.input("pipe:0", format="s16le", ac=1, ar=SAMPLE_RATE)
+		.filter("silencedetect", noise=f"{settings.asr_silence_db}dB", d=settings.asr_min_silence_sec)
+		.output("-", format="null")
+	)
+	_, err = _run(stream, pcm)
+	log = err.decode("utf-8", "replace")
+	starts = [float(x) for x in _SILENCE_START_RE.findall(log)]
+	ends = [float(x) for x in _SILENCE_END_RE.findall(log)]
+	return list(zip(starts, ends))
+
+
+def plan_cuts(duration: float, silences: List[Tuple[float, float]], target: float, max_len: float) -> List[float]:
+	"""Cut points (seconds) near every `target` seconds, snapped to the middle of a pause."""
+	mids = [(s + e) / 2 for s, e in silences]
+	cuts: List[float] = []
+	start = 0.0
+	while duration - start > max_len:
+		window = [m for m in mids if start + target / 2 <= m <= start + max_len]
+		cut = min(window, key=lambda m: abs(m - (start + target))) if window else start + max_len
+		cuts.append(cut)
+		start = cut
+	return cuts
+
+
+def to_wav(pcm: bytes) -> bytes:
+	buf = io.BytesIO()
+	with wave.open(buf, "wb") as w:
+		w.setnchannels(1)
+		w.setsampwidth(2)
+		w.setframerate(SAMPLE_RATE)
+		w.writeframes(pcm)
+	return buf.getvalue()
+
+
+def preprocess(data: bytes) -> List[bytes]:
+	"""Voice note -> ordered WAV chunks; empty if the clip is all silence. Blocking: run in a worker."""
+	pcm = to_pcm(data)
+	duration = len(pcm) / _BYTES_PER_SEC
+	if duration <= 0:
+		return []
+	cuts: List[float] = []
+	if duration > settings.asr_chunk_max_sec:
+		cuts = plan_cuts(duration, find_silences(pcm), settings.asr_chunk_target_sec, settings.asr_chunk_max_sec)
+	bounds = [0] + [int(c * SAMPLE_RATE) * 2 for c in cuts] + [len(pcm)]
+	chunks = [to_wav(pcm[a:b]) for a, b in zip(bounds, bounds[1:]) if b > a]
+	logger.debug("audio prep: %.1fs -> %d chunk(s)", duration, len(chunks))
+	return chunks
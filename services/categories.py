@@ -2,9 +2,10 @@ from __future__ import annotations
 
 from typing import Any, Dict
 from db.models import User
+from db.user_cache import UserSnapshot
 
 
-def build_categories(user: User | None) -> Dict[str, Any]:
+def build_categories(user: User | UserSnapshot | None) -> Dict[str, Any]:
 	if not user:
 		return {
 			"profile": {},
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List
+
+from services.config import settings
+from services.ttl_cache import TTLCache
+from db.database import async_session_scope
+from db import async_repo
+
+logger = logging.getLogger(__name__)
+
+
+class ChatStateStore(ABC):
+	"""Small per-key JSON state with expiry. Keys look like "eph:<chat_id>"."""
+
+	name = "base"
+
+	@abstractmethod
+	async def get(self, key: str) -> Any:
+		raise NotImplementedError
+
+	@abstractmethod
+	async def set(self, key: str, value: Any, ttl_sec: float | None = None) -> None:
+		raise NotImplementedError
+
+	@abstractmethod
+	async def append(self, key: str, item: Any, ttl_sec: float | None = None) -> None:
+		"""Append to the list stored at `key`, starting one if absent or expired."""
+		raise NotImplementedError
+
+	@abstractmethod
+	async def pop(self, key: str) -> Any:
+		"""Return the value and remove it in one step."""
+		raise NotImplementedError
+
+	@abstractmethod
+	async def delete(self, key: str) -> None:
+		raise NotImplementedError
+
+	def stats(self) -> Dict[str, Any]:
+		return {"backend": self.name}
+
+
+class MemoryChatStateStore(ChatStateStore):
+	name = "memory"
+
+	def __init__(self, max_keys: int, ttl_sec: float) -> None:
+		self._data: TTLCache[Any] = TTLCache(max_keys, ttl_sec)
+
+	async def get(self, key: str) -> Any:
+		return self._data.get(key)
+
+	async def set(self, key: str, value: Any, ttl_sec: float | None = None) -> None:
+		self._data.set(key, value, ttl_sec)
+
+	async def append(self, key: str, item: Any, ttl_sec: float | None = None) -> None:
+		items: List[Any] = self._data.get(key) or []
+		items.append(item)
+		self._data.set(key, items, ttl_sec)
+
+	async def pop(self, key: str) -> Any:
+		value = self._data.get(key)
+		self._data.invalidate(key)
+		return value
+
+	async def delete(self, key: str) -> None:
+		self._data.invalidate(key)
+
+	def stats(self) -> Dict[str, Any]:
+		return {"backend": self.name, **self._data.stats()}
+
+
+class SQLiteChatStateStore(ChatStateStore):
+	"""chat_state table; every operation is one statement, so workers can share it."""
+
+	name = "sqlite"
+
+	def __init__(self, max_keys: int, ttl_sec: float, purge_every: int = 1000) -> None:
+		self.max_keys = max_keys
+		self.ttl_sec = ttl_sec
+		self.purge_every = purge_every
+		self._writes = 0
+		self._purged = 0
+
+	def _expiry(self, now: float, ttl_sec: float | None) -> float:
+		return now + (self.ttl_sec if ttl_sec is None else ttl_sec)
+
+	async def _after_write(self) -> None:
+		self._writes += 1
+		if self._writes % self.purge_every:
+			return
+		try:
+			async with async_session_scope() as s:
+				self._purged += await async_repo.purge_chat_state(s, time.time(), self.max_keys)
+		except Exception as e:
+			logger.warning("chat state purge failed: %s", e)
+
+	async def get(self, key: str) -> Any:
+		async with async_session_scope() as s:
+			raw = await async_repo.get_chat_state(s, key, time.time())
+		return json.loads(raw) if raw is not None else None
+
+	async def set(self, key: str, value: Any, ttl_sec: float | None = None) -> None:
+		now = time.time()
+		async with async_session_scope() as s:
+			await async_repo.set_chat_state(s, key, json.dumps(value), self._expiry(now, ttl_sec))
+		await self._after_write()
+
+	async def append(self, key: str, item: Any, ttl_sec: float | None = None) -> None:
+		now = time.time()
+		async with async_session_scope() as s:
+			await async_repo.append_chat_state(s, key, json.dumps(item), now, self._expiry(now, ttl_sec))
+		await self._after_write()
+
+	async def pop(self, key: str) -> Any:
+		async with async_session_scope() as s:
+			raw = await async_repo.pop_chat_state(s, key, time.time())
+		return json.loads(raw) if raw is not None else None
+
+	async def delete(self, key: str) -> None:
+		async with async_session_scope() as s:
+			await async_repo.delete_chat_state(s, key)
+
+	def stats(self) -> Dict[str, Any]:
+		return {"backend": self.name, "writes": self._writes, "purged": self._purged}
+
+
+def _build_store() -> ChatStateStore:
+	if settings.chat_state_backend == "sqlite":
+		if settings.feature_db:
+			return SQLiteChatStateStore(settings.chat_state_max_keys, settings.chat_state_ttl_sec)
+		logger.warning("CHAT_STATE_BACKEND=sqlite needs FEATURE_DB=1, using memory")
+	elif settings.chat_state_backend != "memory":
+		logger.warning("Unknown CHAT_STATE_BACKEND=%r, using memory", settings.chat_state_backend)
+	return MemoryChatStateStore(settings.chat_state_max_keys, settings.chat_state_ttl_sec)
+
+
+chat_state: ChatStateStore = _build_store()
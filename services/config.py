@@ -16,21 +16,126 @@ def env_bool(name: str, default: str = "0") -> bool:
 @dataclass
 class AppSettings:
 	telegram_bot_token: str | None = os.getenv("TELEGRAM_BOT_TOKEN")
+	# "polling" or "webhook"
+	bot_mode: str = os.getenv("BOT_MODE", "polling").strip().lower()
+	# Webhook server; behind a reverse proxy listen on localhost and set WEBHOOK_URL to the public https URL
+	webhook_listen: str = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+	webhook_port: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+	webhook_path: str = os.getenv("WEBHOOK_PATH", "telegram")
+	webhook_url: str | None = os.getenv("WEBHOOK_URL") or None
+	webhook_secret: str | None = os.getenv("WEBHOOK_SECRET") or None
+	webhook_max_connections: int = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+	# Updates of different chats run concurrently; each chat's updates stay in order
+	update_max_running: int = int(os.getenv("UPDATE_MAX_RUNNING", "32"))
+	update_max_pending: int = int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+	# Outbound Bot API sends: interactive replies jump ahead of reminders/broadcasts
+	outbound_global_rate: float = float(os.getenv("OUTBOUND_GLOBAL_RATE", "28"))
+	outbound_chat_rate: float = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+	outbound_chat_burst: float = float(os.getenv("OUTBOUND_CHAT_BURST", "4"))
+	outbound_workers: int = int(os.getenv("OUTBOUND_WORKERS", "8"))
+	outbound_max_retries: int = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
 	openai_api_key: str | None = os.getenv("OPENAI_API_KEY")
 	openrouter_api_key: str | None = os.getenv("OPENROUTER_API_KEY")
 	openrouter_base_url: str = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 	openrouter_model: str = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat-v3-0324:free")
 	database_url: str = os.getenv("DATABASE_URL", "sqlite:////workspace/db/app.db")
 	log_level: str = os.getenv("LOG_LEVEL", "INFO")
+	# Log runtime counters every N seconds (0 = only at shutdown)
+	stats_log_interval_sec: int = int(os.getenv("STATS_LOG_INTERVAL_SEC", "600"))
 	whisper_model: str = os.getenv("WHISPER_MODEL", "whisper-1")
+	asr_timeout_sec: float = float(os.getenv("ASR_TIMEOUT_SEC", "60"))
+	asr_max_connections: int = int(os.getenv("ASR_MAX_CONNECTIONS", "10"))
+	# "remote" (OpenAI Whisper API) or "local" (faster-whisper in a process pool)
+	asr_engine: str = os.getenv("ASR_ENGINE", "remote").strip().lower()
+	asr_local_model: str = os.getenv("ASR_LOCAL_MODEL", "base")
+	asr_local_compute_type: str = os.getenv("ASR_LOCAL_COMPUTE_TYPE", "int8")
+	asr_local_workers: int = int(os.getenv("ASR_LOCAL_WORKERS", "2"))
+	asr_local_cpu_threads: int = int(os.getenv("ASR_LOCAL_CPU_THREADS", "2"))
+	asr_local_language: str | None = os.getenv("ASR_LOCAL_LANGUAGE") or None
+	# ffmpeg preprocessing: 16 kHz mono PCM, silence trim, split long clips at pauses
+	asr_preprocess: bool = env_bool("ASR_PREPROCESS", "1")
+	ffmpeg_bin: str = os.getenv("FFMPEG_BIN", "ffmpeg")
+	asr_silence_db: float = float(os.getenv("ASR_SILENCE_DB", "-35"))
+	asr_min_silence_sec: float = float(os.getenv("ASR_MIN_SILENCE_SEC", "0.4"))
+	asr_chunk_target_sec: float = float(os.getenv("ASR_CHUNK_TARGET_SEC", "30"))
+	asr_chunk_max_sec: float = float(os.getenv("ASR_CHUNK_MAX_SEC", "45"))
+	asr_chunk_concurrency: int = int(os.getenv("ASR_CHUNK_CONCURRENCY", "4"))
 	bot_logo_url: str | None = os.getenv("BOT_LOGO_URL")
+	# Upload menu images to this chat at startup to cache their Telegram file_ids (optional)
+	media_warmup_chat_id: int | None = int(os.getenv("MEDIA_WARMUP_CHAT_ID")) if os.getenv("MEDIA_WARMUP_CHAT_ID") else None
 
 	# Feature flags for staged rollout
 	feature_db: bool = env_bool("FEATURE_DB", "0")
 	feature_asr: bool = env_bool("FEATURE_ASR", "0")
 	feature_llm: bool = env_bool("FEATURE_LLM", "0")
 	feature_reminder: bool = env_bool("FEATURE_REMINDER", "0")
+	feature_pregen: bool = env_bool("FEATURE_PREGEN", "0")
 	reminder_hour: int = int(os.getenv("REMINDER_HOUR", "9"))
+	# Telegram allows ~30 msg/s globally; keep headroom for interactive replies
+	reminder_rate_per_sec: float = float(os.getenv("REMINDER_RATE_PER_SEC", "20"))
+	reminder_concurrency: int = int(os.getenv("REMINDER_CONCURRENCY", "16"))
+	reminder_page_size: int = int(os.getenv("REMINDER_PAGE_SIZE", "500"))
+	# Local send window after REMINDER_HOUR, split into slots; users are spread over slots by id
+	reminder_window_minutes: int = int(os.getenv("REMINDER_WINDOW_MINUTES", "60"))
+	reminder_slot_minutes: int = int(os.getenv("REMINDER_SLOT_MINUTES", "5"))
+	# Used for users without User.timezone: IANA name or offset like +03:00
+	default_timezone: str = os.getenv("DEFAULT_TIMEZONE", "UTC")
+	# Reminder/pre-generation checkpoints are per day; older ones are deleted once a day
+	job_checkpoint_retention_days: int = int(os.getenv("JOB_CHECKPOINT_RETENTION_DAYS", "3"))
+
+	# Off-peak pre-generation of next week's plans
+	pregen_hours: str = os.getenv("PREGEN_HOURS", "2-5")
+	pregen_lookahead_days: int = int(os.getenv("PREGEN_LOOKAHEAD_DAYS", "2"))
+	pregen_concurrency: int = int(os.getenv("PREGEN_CONCURRENCY", "2"))
+	pregen_max_users_per_run: int = int(os.getenv("PREGEN_MAX_USERS_PER_RUN", "200"))
+	pregen_max_run_sec: int = int(os.getenv("PREGEN_MAX_RUN_SEC", "1800"))
+
+	# OpenRouter HTTP client (shared pool)
+	openrouter_timeout_sec: float = float(os.getenv("OPENROUTER_TIMEOUT_SEC", "30"))
+	openrouter_http2: bool = env_bool("OPENROUTER_HTTP2", "1")
+	openrouter_max_connections: int = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "20"))
+	openrouter_max_keepalive: int = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "10"))
+	openrouter_keepalive_expiry_sec: float = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY_SEC", "60"))
+	openrouter_max_retries: int = int(os.getenv("OPENROUTER_MAX_RETRIES", "3"))
+	openrouter_backoff_base_sec: float = float(os.getenv("OPENROUTER_BACKOFF_BASE_SEC", "0.5"))
+	openrouter_backoff_max_sec: float = float(os.getenv("OPENROUTER_BACKOFF_MAX_SEC", "8"))
+	# Stream chat replies and edit the Telegram message as tokens arrive
+	llm_streaming: bool = env_bool("LLM_STREAMING", "1")
+	llm_stream_edit_interval_sec: float = float(os.getenv("LLM_STREAM_EDIT_INTERVAL_SEC", "1.0"))
+
+	# LLM response cache (memory LRU + SQLite)
+	llm_cache_enabled: bool = env_bool("LLM_CACHE_ENABLED", "1")
+	llm_cache_ttl_sec: int = int(os.getenv("LLM_CACHE_TTL_SEC", "86400"))
+	llm_cache_max_entries: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+	# SQLite tier: expired rows and the overflow beyond the cap are purged every N writes
+	llm_cache_max_rows: int = int(os.getenv("LLM_CACHE_MAX_ROWS", "50000"))
+	llm_cache_purge_every: int = int(os.getenv("LLM_CACHE_PURGE_EVERY", "500"))
+	llm_cache_skip_routes: frozenset[str] = frozenset(
+		r.strip() for r in os.getenv("LLM_CACHE_SKIP_ROUTES", "").split(",") if r.strip()
+	)
+
+	# Write-behind queue for audit/loyalty writes
+	write_behind_max_queue: int = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+	write_behind_batch_size: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100"))
+	write_behind_flush_ms: int = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+
+	# Per-user profile cache keyed by Telegram id
+	user_cache_max_entries: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+	user_cache_ttl_sec: int = int(os.getenv("USER_CACHE_TTL_SEC", "300"))
+
+	# Plan views: rendered day messages + plan-id memo in the planner
+	render_cache_max_entries: int = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "20000"))
+	render_cache_ttl_sec: int = int(os.getenv("RENDER_CACHE_TTL_SEC", "3600"))
+
+	# Transcripts keyed by Telegram file_unique_id (memory LRU + transcriptions table)
+	transcript_cache_max_entries: int = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "1000"))
+	transcript_cache_ttl_sec: int = int(os.getenv("TRANSCRIPT_CACHE_TTL_SEC", "86400"))
+
+	# Per-chat UI state (messages to clean up, pending input): "memory" or "sqlite" (shared by workers, needs FEATURE_DB)
+	chat_state_backend: str = os.getenv("CHAT_STATE_BACKEND", "memory").strip().lower()
+	# Telegram only lets bots delete messages younger than 48 h
+	chat_state_ttl_sec: int = int(os.getenv("CHAT_STATE_TTL_SEC", "172800"))
+	chat_state_max_keys: int = int(os.getenv("CHAT_STATE_MAX_KEYS", "100000"))
 
 
 settings = AppSettings()
@@ -40,6 +145,11 @@ def assert_required_settings() -> None:
 	missing: list[str] = []
 	if not settings.telegram_bot_token:
 		missing.append("TELEGRAM_BOT_TOKEN")
+	if settings.bot_mode == "webhook":
+		if not settings.webhook_url:
+			missing.append("WEBHOOK_URL")
+		if not settings.webhook_secret:
+			missing.append("WEBHOOK_SECRET")
 	if missing:
 		raised = ", ".join(missing)
 		raise RuntimeError(f"Не заданы обязательные переменные окружения: {raised}. См. .env.template")
\ No newline at end of file
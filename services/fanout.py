@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from telegram.error import Forbidden, RetryAfter
+
+from services.ratelimit import TokenBucket, retry_after_seconds
+from db.database import async_session_scope
+from db import async_repo
+
+logger = logging.getLogger(__name__)
+
+# (row id used as the paging cursor, Telegram chat id)
+Target = Tuple[int, int]
+PageFn = Callable[[int, int], Awaitable[List[Target]]]
+SendFn = Callable[[int], Awaitable[Any]]
+
+
+@dataclass
+class FanoutStats:
+	sent: int = 0
+	failed: int = 0
+	blocked: int = 0
+	flood_waits: int = 0
+	cursor: int = 0
+
+	def as_dict(self) -> Dict[str, int]:
+		return asdict(self)
+
+
+class FanoutEngine:
+	"""Sends to many chats: keyset-paged ids, bounded concurrency, global rate limit, per-page checkpoints."""
+
+	def __init__(self, rate_per_sec: float, concurrency: int, page_size: int, max_retries: int = 3) -> None:
+		self.bucket = TokenBucket(rate_per_sec)
+		self.concurrency = max(1, concurrency)
+		self.page_size = max(1, page_size)
+		self.max_retries = max_retries
+
+	async def run(self, job: str, next_page: PageFn, send: SendFn) -> FanoutStats:
+		"""Resume `job` from its checkpoint and call `send(chat_id)` for every remaining target."""
+		async with async_session_scope() as s:
+			cursor = int(await async_repo.get_checkpoint(s, job) or 0)
+		stats = FanoutStats(cursor=cursor)
+		sem = asyncio.Semaphore(self.concurrency)
+
+		async def _deliver(chat_id: int) -> None:
+			async with sem:
+				for _attempt in range(self.max_retries + 1):
+					await self.bucket.acquire()
+					try:
+						await send(chat_id)
+						stats.sent += 1
+						return
+					except RetryAfter as e:
+						stats.flood_waits += 1
+						self.bucket.pause(retry_after_seconds(e))
+					except Forbidden:
+						# user blocked the bot / deleted account
+						stats.blocked += 1
+						return
+					except Exception as e:
+						logger.warning("fan-out %s: send to %s failed: %s", job, chat_id, e)
+						break
+				stats.failed += 1
+
+		while True:
+			page = await next_page(cursor, self.page_size)
+			if not page:
+				break
+			await asyncio.gather(*(_deliver(chat_id) for _, chat_id in page))
+			cursor = page[-1][0]
+			stats.cursor = cursor
+			async with async_session_scope() as s:
+				await async_repo.set_checkpoint(s, job, str(cursor))
+		return stats
@@ -21,4 +21,9 @@ def get_image_url(topic: str) -> str | None:
 	override = os.getenv(f"IMAGE_{topic.upper()}")
 	if override:
 		return override
-	return _DEFAULT_IMAGES.get(topic) or _DEFAULT_IMAGES.get("generic")
\ No newline at end of file
+	return _DEFAULT_IMAGES.get(topic) or _DEFAULT_IMAGES.get("generic")
+
+
+def all_image_urls() -> list[str]:
+	"""Every distinct URL get_image_url can return, overrides applied."""
+	return sorted({url for url in (get_image_url(t) for t in _DEFAULT_IMAGES) if url})
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from services.config import settings
+from services.ttl_cache import TTLCache
+from services.utils import compute_uniqueness_hash
+from db.database import async_session_scope
+from db import async_repo
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+
+_memory: TTLCache[str] = TTLCache(settings.llm_cache_max_entries, settings.llm_cache_ttl_sec)
+_db_hits = 0
+_db_misses = 0
+_db_writes = 0
+_db_purged = 0
+
+
+def _normalize(text: str) -> str:
+	return _WS_RE.sub(" ", text).strip()
+
+
+def make_key(model: str, categories: Dict[str, Any], user_text: str) -> str:
+	cats = json.dumps(categories, ensure_ascii=False, sort_keys=True)
+	return compute_uniqueness_hash("\n".join((model, _normalize(user_text), cats)))
+
+
+def is_enabled(route: str) -> bool:
+	return settings.llm_cache_enabled and route not in settings.llm_cache_skip_routes
+
+
+async def get(key: str) -> str | None:
+	global _db_hits, _db_misses
+	content = _memory.get(key)
+	if content is not None or not settings.feature_db:
+		return content
+	try:
+		async with async_session_scope() as s:
+			entry = await async_repo.get_llm_cache_entry(s, key, datetime.utcnow().isoformat())
+			content = entry.content if entry else None
+	except Exception as e:
+		logger.warning("llm cache read failed: %s", e)
+		return None
+	if content is None:
+		_db_misses += 1
+		return None
+	_db_hits += 1
+	_memory.set(key, content)
+	return content
+
+
+async def _after_write() -> None:
+	global _db_writes, _db_purged
+	_db_writes += 1
+	if _db_writes % max(1, settings.llm_cache_purge_every):
+		return
+	try:
+		async with async_session_scope() as s:
+			_db_purged += await async_repo.purge_llm_cache(s, datetime.utcnow().isoformat(), settings.llm_cache_max_rows)
+	except Exception as e:
+		logger.warning("llm cache purge failed: %s", e)
+
+
+async def put(key: str, model: str, content: str) -> None:
+	_memory.set(key, content)
+	if not settings.feature_db:
+		return
+	expires_at = (datetime.utcnow() + timedelta(seconds=settings.llm_cache_ttl_sec)).isoformat()
+	try:
+		async with async_session_scope() as s:
+			await async_repo.put_llm_cache_entry(s, key, model, content, expires_at)
+	except Exception as e:
+		logger.warning("llm cache write failed: %s", e)
+		return
+	await _after_write()
+
+
+def stats() -> Dict[str, Any]:
+	return {"memory": _memory.stats(), "db_hits": _db_hits, "db_misses": _db_misses, "db_writes": _db_writes, "db_purged": _db_purged}
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict
+
+from telegram.error import BadRequest
+
+from services.config import settings
+from services.outbound import outbound
+from db.database import async_session_scope
+from db import async_repo
+
+logger = logging.getLogger(__name__)
+
+# image URL -> Telegram file_id; a handful of menu images, so a plain dict
+_file_ids: Dict[str, str] = {}
+# BadRequest texts that mean the file_id itself is unusable (not the caption, markup, ...)
+_STALE_FILE_ID_MARKERS = ("file identifier", "file_id", "file reference")
+_hits = 0
+_uploads = 0
+_stale = 0
+
+
+async def load() -> None:
+	"""Pull persisted file_ids into memory (startup)."""
+	if not settings.feature_db:
+		return
+	async with async_session_scope() as s:
+		_file_ids.update(await async_repo.list_media_files(s))
+	logger.info("media cache: %d file_id(s) loaded", len(_file_ids))
+
+
+async def _remember(url: str, file_id: str) -> None:
+	_file_ids[url] = file_id
+	if not settings.feature_db:
+		return
+	try:
+		async with async_session_scope() as s:
+			await async_repo.set_media_file(s, url, file_id)
+	except Exception as e:
+		logger.warning("media cache write failed: %s", e)
+
+
+async def _forget(url: str) -> None:
+	_file_ids.pop(url, None)
+	if not settings.feature_db:
+		return
+	try:
+		async with async_session_scope() as s:
+			await async_repo.delete_media_file(s, url)
+	except Exception as e:
+		logger.warning("media cache delete failed: %s", e)
+
+
+async def send_photo(bot, chat_id: int, url: str, **kwargs: Any):
+	"""send_photo by cached file_id; uploads from `url` (and caches the result) when there is none or it went stale."""
+	global _hits, _uploads, _stale
+	file_id = _file_ids.get(url)
+	if file_id:
+		try:
+			msg = await outbound.submit(bot.send_photo, chat_id=chat_id, photo=file_id, **kwargs)
+			_hits += 1
+			return msg
+		except BadRequest as e:
+			if not any(m in str(e).lower() for m in _STALE_FILE_ID_MARKERS):
+				raise
+			# file_ids are per bot; a token change or purge invalidates them
+			logger.warning("cached file_id for %s rejected (%s), re-uploading", url, e)
+			_stale += 1
+			await _forget(url)
+	msg = await outbound.submit(bot.send_photo, chat_id=chat_id, photo=url, **kwargs)
+	_uploads += 1
+	if msg.photo:
+		await _remember(url, msg.photo[-1].file_id)
+	return msg
+
+
+async def warm_up(bot, chat_id: int, urls: list[str]) -> None:
+	"""Upload every not-yet-cached URL once to `chat_id`, keep the file_id, delete the message."""
+	for url in urls:
+		if url in _file_ids:
+			continue
+		try:
+			msg = await send_photo(bot, chat_id, url, disable_notification=True)
+		except Exception as e:
+			logger.warning("media warm-up failed for %s: %s", url, e)
+			continue
+		try:
+			await bot.delete_message(chat_id=chat_id, message_id=msg.message_id)
+		except Exception:
+			pass
+
+
+def stats() -> Dict[str, Any]:
+	return {"cached": len(_file_ids), "hits": _hits, "uploads": _uploads, "stale": _stale}
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
-from typing import Any, Dict, Tuple
+import random
+from typing import Any, AsyncIterator, Callable, Dict, Tuple
 import httpx
 
 from services.config import settings
+from services import llm_cache
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +23,92 @@ class OpenRouterError(Exception):
 	pass
 
 
-async def chat_completion(categories: Dict[str, Any], user_text: str) -> Tuple[str, Dict[str, Any]]:
-	if not settings.openrouter_api_key:
-		raise OpenRouterError("Отсутствует OPENROUTER_API_KEY")
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_client: httpx.AsyncClient | None = None
+_retries_total = 0
+
+
+def get_client() -> httpx.AsyncClient:
+	"""Shared keep-alive client; created lazily and owned by the app until close_client()."""
+	global _client
+	if _client is None or _client.is_closed:
+		_client = httpx.AsyncClient(
+			http2=settings.openrouter_http2,
+			timeout=httpx.Timeout(settings.openrouter_timeout_sec),
+			limits=httpx.Limits(
+				max_connections=settings.openrouter_max_connections,
+				max_keepalive_connections=settings.openrouter_max_keepalive,
+				keepalive_expiry=settings.openrouter_keepalive_expiry_sec,
+			),
+		)
+	return _client
+
+
+async def close_client() -> None:
+	global _client
+	if _client is not None and not _client.is_closed:
+		await _client.aclose()
+	_client = None
+
+
+def pool_stats() -> Dict[str, Any]:
+	active = idle = 0
+	if _client is not None and not _client.is_closed:
+		# httpx keeps the httpcore pool private; read it defensively
+		pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+		for conn in getattr(pool, "connections", []) or []:
+			if conn.is_idle():
+				idle += 1
+			else:
+				active += 1
+	return {
+		"active_connections": active,
+		"idle_connections": idle,
+		"max_connections": settings.openrouter_max_connections,
+		"max_keepalive": settings.openrouter_max_keepalive,
+		"retries_total": _retries_total,
+	}
+
+
+def _backoff_delay(attempt: int, retry_after: str | None) -> float:
+	if retry_after:
+		try:
+			return min(float(retry_after), settings.openrouter_backoff_max_sec)
+		except ValueError:
+			pass
+	cap = min(settings.openrouter_backoff_max_sec, settings.openrouter_backoff_base_sec * (2 ** attempt))
+	# full jitter
+	return random.uniform(0, cap)
+
+
+async def _post_with_retries(url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> httpx.Response:
+	global _retries_total
+	client = get_client()
+	attempt = 0
+	while True:
+		try:
+			resp = await client.post(url, headers=headers, json=payload)
+		except httpx.TransportError as e:
+			if attempt >= settings.openrouter_max_retries:
+				logger.error("OpenRouter transport error: %s", e)
+				raise OpenRouterError("OpenRouter недоступен") from e
+			delay = _backoff_delay(attempt, None)
+		else:
+			if resp.status_code not in _RETRY_STATUSES or attempt >= settings.openrouter_max_retries:
+				return resp
+			delay = _backoff_delay(attempt, resp.headers.get("Retry-After"))
+			logger.warning("OpenRouter %s, retry %s in %.2fs", resp.status_code, attempt + 1, delay)
+		attempt += 1
+		_retries_total += 1
+		await asyncio.sleep(delay)
+
 
-	model = getattr(settings, "openrouter_model", None) or "openai/gpt-4o-mini"
+def _model() -> str:
+	return getattr(settings, "openrouter_model", None) or "openai/gpt-4o-mini"
+
+
+def _build_request(model: str, categories: Dict[str, Any], user_text: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
 	url = settings.openrouter_base_url.rstrip("/") + "/chat/completions"
 	headers = {
 		"Authorization": f"Bearer {settings.openrouter_api_key}",
@@ -47,13 +131,34 @@ async def chat_completion(categories: Dict[str, Any], user_text: str) -> Tuple[s
 		],
 		"temperature": 0.4,
 	}
+	return url, headers, payload
+
+
+async def chat_completion(
+	categories: Dict[str, Any],
+	user_text: str,
+	route: str = "chat",
+	use_cache: bool = True,
+	validate: Callable[[str], bool] | None = None,
+) -> Tuple[str, Dict[str, Any]]:
+	"""One completion; replies `validate` rejects are returned but not cached."""
+	if not settings.openrouter_api_key:
+		raise OpenRouterError("Отсутствует OPENROUTER_API_KEY")
 
-	async with httpx.AsyncClient(timeout=httpx.Timeout(30.0)) as client:
-		resp = await client.post(url, headers=headers, json=payload)
-		if resp.status_code >= 400:
-			logger.error("OpenRouter error %s: %s", resp.status_code, resp.text[:500])
-			raise OpenRouterError(f"Ошибка OpenRouter: {resp.status_code}")
-		data = resp.json()
+	model = _model()
+	cache_key = None
+	if use_cache and llm_cache.is_enabled(route):
+		cache_key = llm_cache.make_key(model, categories, user_text)
+		cached = await llm_cache.get(cache_key)
+		if cached is not None and (validate is None or validate(cached)):
+			return cached, {"cached": True}
+	url, headers, payload = _build_request(model, categories, user_text)
+
+	resp = await _post_with_retries(url, headers, payload)
+	if resp.status_code >= 400:
+		logger.error("OpenRouter error %s: %s", resp.status_code, resp.text[:500])
+		raise OpenRouterError(f"Ошибка OpenRouter: {resp.status_code}")
+	data = resp.json()
 
 	choices = data.get("choices", [])
 	if not choices:
@@ -61,4 +166,81 @@ async def chat_completion(categories: Dict[str, Any], user_text: str) -> Tuple[s
 
 	text = choices[0].get("message", {}).get("content", "")
 	usage = data.get("usage", {})
-	return text, usage
\ No newline at end of file
+	if cache_key and text and (validate is None or validate(text)):
+		await llm_cache.put(cache_key, model, text)
+	return text, usage
+
+
+async def chat_completion_stream(
+	categories: Dict[str, Any],
+	user_text: str,
+	route: str = "chat",
+	use_cache: bool = True,
+	usage_out: Dict[str, Any] | None = None,
+) -> AsyncIterator[str]:
+	"""Yield content deltas as they arrive (SSE, stream=true). Usage, if reported, is written to usage_out."""
+	global _retries_total
+	if not settings.openrouter_api_key:
+		raise OpenRouterError("Отсутствует OPENROUTER_API_KEY")
+
+	model = _model()
+	cache_key = None
+	if use_cache and llm_cache.is_enabled(route):
+		cache_key = llm_cache.make_key(model, categories, user_text)
+		cached = await llm_cache.get(cache_key)
+		if cached is not None:
+			if usage_out is not None:
+				usage_out["cached"] = True
+			yield cached
+			return
+	url, headers, payload = _build_request(model, categories, user_text)
+	payload["stream"] = True
+
+	client = get_client()
+	parts: list[str] = []
+	attempt = 0
+	while True:
+		delay = None
+		try:
+			async with client.stream("POST", url, headers=headers, json=payload) as resp:
+				if resp.status_code in _RETRY_STATUSES and attempt < settings.openrouter_max_retries:
+					delay = _backoff_delay(attempt, resp.headers.get("Retry-After"))
+					logger.warning("OpenRouter %s, retry %s in %.2fs", resp.status_code, attempt + 1, delay)
+				elif resp.status_code >= 400:
+					body = (await resp.aread()).decode("utf-8", "replace")
+					logger.error("OpenRouter error %s: %s", resp.status_code, body[:500])
+					raise OpenRouterError(f"Ошибка OpenRouter: {resp.status_code}")
+				else:
+					async for line in resp.aiter_lines():
+						# SSE: "data: {...}"; lines starting with ":" are keep-alive comments
+						if not line.startswith("data:"):
+							continue
+						data = line[5:].strip()
+						if data == "[DONE]":
+							break
+						chunk = json.loads(data)
+						if chunk.get("error"):
+							raise OpenRouterError(f"Ошибка OpenRouter: {chunk['error'].get('message', '')[:200]}")
+						if chunk.get("usage") and usage_out is not None:
+							usage_out.update(chunk["usage"])
+						choices = chunk.get("choices") or []
+						delta = (choices[0].get("delta") or {}).get("content") if choices else None
+						if delta:
+							parts.append(delta)
+							yield delta
+		except httpx.TransportError as e:
+			# only retry if nothing was shown to the user yet
+			if parts or attempt >= settings.openrouter_max_retries:
+				logger.error("OpenRouter stream error: %s", e)
+				raise OpenRouterError("OpenRouter недоступен") from e
+			delay = _backoff_delay(attempt, None)
+		if delay is None:
+			break
+		attempt += 1
+		_retries_total += 1
+		await asyncio.sleep(delay)
+
+	if not parts:
+		raise OpenRouterError("Пустой ответ от LLM")
+	if cache_key:
+		await llm_cache.put(cache_key, model, "".join(parts))
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List
+
+from telegram.error import RetryAfter
+
+from services.config import settings
+from services.ratelimit import TokenBucket, retry_after_seconds
+from services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+	INTERACTIVE = 0  # replies to a user action
+	BULK = 1  # reminders, broadcasts
+
+
+@dataclass
+class _Job:
+	chat_id: int | None
+	fn: Callable[..., Awaitable[Any]]
+	args: tuple
+	kwargs: Dict[str, Any]
+	priority: Priority
+	retries: int
+	future: asyncio.Future
+	enqueued_at: float = field(default_factory=time.monotonic)
+	attempts: int = 0
+
+
+class _Latency:
+	def __init__(self) -> None:
+		self.count = 0
+		self.total_ms = 0.0
+		self.max_ms = 0.0
+
+	def add(self, ms: float) -> None:
+		self.count += 1
+		self.total_ms += ms
+		self.max_ms = max(self.max_ms, ms)
+
+	def as_dict(self) -> Dict[str, Any]:
+		return {
+			"count": self.count,
+			"avg_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+			"max_ms": round(self.max_ms, 1),
+		}
+
+
+class OutboundDispatcher:
+	"""Single path for Bot API sends: priority queue, global + per-chat token buckets, RetryAfter handling.
+
+	Jobs whose chat is over its budget are parked with call_later instead of
+	holding a worker, so one busy chat never stalls the others.
+	"""
+
+	def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, workers: int, max_retries: int) -> None:
+		self.global_bucket = TokenBucket(global_rate)
+		self.chat_rate = chat_rate
+		self.chat_burst = chat_burst
+		self.workers = max(1, workers)
+		self.max_retries = max_retries
+		self._chat_buckets: TTLCache[TokenBucket] = TTLCache(100_000, 600)
+		self._queue: asyncio.PriorityQueue | None = None
+		self._tasks: List[asyncio.Task] = []
+		self._seq = itertools.count()
+		self._depth = {p: 0 for p in Priority}
+		self._wait = {p: _Latency() for p in Priority}
+		self._sent = 0
+		self._failed = 0
+		self._flood_waits = 0
+
+	def start(self) -> None:
+		if self._tasks:
+			return
+		self._queue = asyncio.PriorityQueue()
+		self._tasks = [asyncio.create_task(self._worker(), name=f"outbound-{i}") for i in range(self.workers)]
+
+	async def stop(self) -> None:
+		for t in self._tasks:
+			t.cancel()
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+		self._tasks = []
+		logger.info("Outbound dispatcher: %s", self.stats())
+
+	async def submit(self, fn: Callable[..., Awaitable[Any]], /, *args: Any, priority: Priority = Priority.INTERACTIVE, retries: int | None = None, **kwargs: Any) -> Any:
+		"""Queue `fn(*args, **kwargs)` (a Bot method taking chat_id=...) and return its result.
+
+		`retries` caps RetryAfter re-sends; pass 0 for best-effort calls such as progress edits.
+		"""
+		if not self._tasks:
+			return await fn(*args, **kwargs)
+		job = _Job(
+			chat_id=kwargs.get("chat_id"),
+			fn=fn,
+			args=args,
+			kwargs=kwargs,
+			priority=priority,
+			retries=self.max_retries if retries is None else retries,
+			future=asyncio.get_running_loop().create_future(),
+		)
+		self._put(job)
+		return await job.future
+
+	def _put(self, job: _Job) -> None:
+		self._depth[job.priority] += 1
+		self._queue.put_nowait((job.priority, next(self._seq), job))
+
+	def _requeue_later(self, job: _Job, delay: float) -> None:
+		self._depth[job.priority] += 1
+		asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, (job.priority, next(self._seq), job))
+
+	def _chat_bucket(self, chat_id: int) -> TokenBucket:
+		bucket = self._chat_buckets.get(chat_id)
+		if bucket is None:
+			bucket = TokenBucket(self.chat_rate, self.chat_burst)
+			self._chat_buckets.set(chat_id, bucket)
+		return bucket
+
+	async def _worker(self) -> None:
+		while True:
+			# token first, job second: the job is picked by priority at the moment it can actually go out
+			await self.global_bucket.acquire()
+			_, _, job = await self._queue.get()
+			self._depth[job.priority] -= 1
+			if job.future.done():  # caller went away
+				continue
+			if job.chat_id is not None:
+				delay = self._chat_bucket(job.chat_id).try_acquire()
+				if delay > 0:
+					self._requeue_later(job, delay)
+					continue
+			if job.attempts == 0:
+				self._wait[job.priority].add((time.monotonic() - job.enqueued_at) * 1000)
+			job.attempts += 1
+			try:
+				result = await job.fn(*job.args, **job.kwargs)
+			except RetryAfter as e:
+				self._flood_waits += 1
+				wait = retry_after_seconds(e)
+				if job.chat_id is not None:
+					self._chat_bucket(job.chat_id).pause(wait)
+				# a flood-wait during a blast is bot-wide: hold every worker, not just this chat
+				if job.priority == Priority.BULK or job.chat_id is None:
+					self.global_bucket.pause(wait)
+				if job.attempts > job.retries:
+					self._failed += 1
+					if not job.future.done():
+						job.future.set_exception(e)
+				else:
+					self._requeue_later(job, wait)
+				continue
+			except Exception as e:
+				self._failed += 1
+				if not job.future.done():
+					job.future.set_exception(e)
+				continue
+			self._sent += 1
+			if not job.future.done():
+				job.future.set_result(result)
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"queued": {p.name.lower(): n for p, n in self._depth.items()},
+			"queue_wait": {p.name.lower(): lat.as_dict() for p, lat in self._wait.items()},
+			"sent": self._sent,
+			"failed": self._failed,
+			"flood_waits": self._flood_waits,
+		}
+
+
+outbound = OutboundDispatcher(
+	global_rate=settings.outbound_global_rate,
+	chat_rate=settings.outbound_chat_rate,
+	chat_burst=settings.outbound_chat_burst,
+	workers=settings.outbound_workers,
+	max_retries=settings.outbound_max_retries,
+)
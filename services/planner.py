@@ -7,28 +7,79 @@ from typing import Any, Dict, List, Tuple
 
 from services.openrouter_client import chat_completion, OpenRouterError
 from services.utils import extract_json_block
-from db.database import session_scope
-from db import repo
+from services.config import settings
+from services.singleflight import SingleFlight
+from services.ttl_cache import TTLCache
+from services.timezones import iso_week_start, local_today
+from db.database import async_session_scope
+from db import async_repo
 
 
-def _week_range(today: date) -> Tuple[str, str]:
-	start = today
-	end = today + timedelta(days=6)
+# One generation per (user, plan kind, week); concurrent taps await the same task
+_generation = SingleFlight()
+# (user id, plan kind, week start) -> (plan_id, plan_start) once the week's 7 days exist; ISO-week plans only
+_plan_ids: TTLCache[Tuple[int, str]] = TTLCache(settings.render_cache_max_entries, settings.render_cache_ttl_sec)
+
+
+def _parse_days(content: str) -> List[Dict[str, Any]]:
+	"""`days` of a plan reply; empty unless it parses into at least 7 day objects."""
+	days = (extract_json_block(content) or {}).get("days")
+	if not isinstance(days, list) or len(days) < 7 or not all(isinstance(d, dict) for d in days):
+		return []
+	return days
+
+
+def _is_week(content: str) -> bool:
+	return bool(_parse_days(content))
+
+
+def _week_range(day: date) -> Tuple[str, str]:
+	"""ISO week (Mon..Sun) containing `day`."""
+	start = iso_week_start(day)
+	end = start + timedelta(days=6)
 	return start.isoformat(), end.isoformat()
 
 
-async def ensure_week_workouts(user) -> Tuple[int, int]:
-	"""Ensure workout plan exists for current week. Returns (plan_id, today_index)."""
-	today = date.today()
-	start_str, end_str = _week_range(today)
-	with session_scope() as s:
-		plan = repo.get_or_create_active_workout_plan(s, user.id, start_str, end_str)
+async def ensure_week_workouts(user, day: date | None = None) -> Tuple[int, int]:
+	"""Ensure workout plan exists for the week of `day` (default: user's today). Returns (plan_id, day_index)."""
+	today = local_today(user.timezone)
+	day = day or today
+	start_str, end_str = _week_range(day)
+	key = (user.id, "workouts", start_str)
+	found = _plan_ids.get(key)
+	if found is None:
+		found = await _generation.do(key, lambda: _ensure_workout_days(user, day.isoformat(), today.isoformat(), start_str, end_str))
+		# a reused pre-ISO-week plan ends mid-week; memoizing it would outlive its end_date
+		if found[1] == start_str:
+			_plan_ids.set(key, found)
+	plan_id, plan_start = found
+	return plan_id, (day - date.fromisoformat(plan_start)).days
+
+
+async def ensure_week_meals(user, day: date | None = None) -> Tuple[int, int]:
+	"""Ensure meal plan exists for the week of `day` (default: user's today). Returns (meal_plan_id, day_index)."""
+	today = local_today(user.timezone)
+	day = day or today
+	start_str, end_str = _week_range(day)
+	key = (user.id, "meals", start_str)
+	found = _plan_ids.get(key)
+	if found is None:
+		found = await _generation.do(key, lambda: _ensure_meal_days(user, day.isoformat(), today.isoformat(), start_str, end_str))
+		if found[1] == start_str:
+			_plan_ids.set(key, found)
+	plan_id, plan_start = found
+	return plan_id, (day - date.fromisoformat(plan_start)).days
+
+
+async def _ensure_workout_days(user, day_str: str, today_str: str, start_str: str, end_str: str) -> Tuple[int, str]:
+	async with async_session_scope() as s:
+		# reuse any active plan covering the day (incl. pre-ISO-week plans) before opening a new window
+		plan = await async_repo.get_active_workout_plan_for_date(s, user.id, day_str)
+		if plan is None:
+			plan = await async_repo.get_or_create_active_workout_plan(s, user.id, start_str, end_str, today_str)
+		plan_id, plan_start = plan.id, plan.start_date
 		# if days missing, try to generate
-		missing = False
-		for i in range(7):
-			if not repo.get_workout_day(s, plan.id, i):
-				missing = True
-				break
+		missing = len(await async_repo.get_workout_days(s, plan_id)) < 7
 	if missing:
 		# prompt LLM to return JSON
 		prompt = (
@@ -37,9 +88,9 @@ async def ensure_week_workouts(user) -> Tuple[int, int]:
 			". Пиши кратко, безопасно, Пиши, сокращай."
 		)
 		try:
-			content, _ = await chat_completion({}, prompt)
-			data = extract_json_block(content) or {}
-			days = data.get("days") or []
+			# fixed prompt = one cache key for everyone: only a reply that parses may be cached
+			content, _ = await chat_completion({}, prompt, route="plan_workouts", validate=_is_week)
+			days = _parse_days(content)
 		except OpenRouterError:
 			days = []
 		if not days or len(days) < 7:
@@ -48,25 +99,22 @@ async def ensure_week_workouts(user) -> Tuple[int, int]:
 				{"title": f"День {i+1}", "text": "Разминка 5 мин. Базовые упражнения 20–30 мин. Растяжка 5 мин."}
 				for i in range(7)
 			]
-		with session_scope() as s2:
-			plan = repo.get_or_create_active_workout_plan(s2, user.id, start_str, end_str)
-			for i in range(7):
-				d = days[i] if i < len(days) else {"title": f"День {i+1}", "text": "Отдых/мобилити 20 мин"}
-				repo.upsert_workout_day(s2, plan.id, i, d.get("title") or f"День {i+1}", d.get("text") or "...")
-	return plan.id, (today - date.fromisoformat(start_str)).days
-
-
-async def ensure_week_meals(user) -> Tuple[int, int]:
-	"""Ensure meal plan exists for current week. Returns (meal_plan_id, today_index)."""
-	today = date.today()
-	start_str, end_str = _week_range(today)
-	with session_scope() as s:
-		plan = repo.get_or_create_active_meal_plan(s, user.id, start_str, end_str)
-		missing = False
+		rows = {}
 		for i in range(7):
-			if not repo.get_meal_day(s, plan.id, i):
-				missing = True
-				break
+			d = days[i] if i < len(days) else {"title": f"День {i+1}", "text": "Отдых/мобилити 20 мин"}
+			rows[i] = (d.get("title") or f"День {i+1}", d.get("text") or "...")
+		async with async_session_scope() as s2:
+			await async_repo.upsert_workout_days(s2, plan_id, rows)
+	return plan_id, plan_start
+
+
+async def _ensure_meal_days(user, day_str: str, today_str: str, start_str: str, end_str: str) -> Tuple[int, str]:
+	async with async_session_scope() as s:
+		plan = await async_repo.get_active_meal_plan_for_date(s, user.id, day_str)
+		if plan is None:
+			plan = await async_repo.get_or_create_active_meal_plan(s, user.id, start_str, end_str, today_str)
+		plan_id, plan_start = plan.id, plan.start_date
+		missing = len(await async_repo.get_meal_days(s, plan_id)) < 7
 	if missing:
 		prompt = (
 			"Составь недельный план питания на 7 дней в JSON. Формат: {\n"
@@ -74,9 +122,8 @@ async def ensure_week_meals(user) -> Tuple[int, int]:
 			". Укажи КБЖУ суммарно на день. Пиши кратко."
 		)
 		try:
-			content, _ = await chat_completion({}, prompt)
-			data = extract_json_block(content) or {}
-			days = data.get("days") or []
+			content, _ = await chat_completion({}, prompt, route="plan_meals", validate=_is_week)
+			days = _parse_days(content)
 		except OpenRouterError:
 			days = []
 		if not days or len(days) < 7:
@@ -84,9 +131,10 @@ async def ensure_week_meals(user) -> Tuple[int, int]:
 				{"title": f"День {i+1}", "text": "~2200 ккал. 3–4 приёма пищи: завтрак/обед/ужин и перекус."}
 				for i in range(7)
 			]
-		with session_scope() as s2:
-			plan = repo.get_or_create_active_meal_plan(s2, user.id, start_str, end_str)
-			for i in range(7):
-				d = days[i] if i < len(days) else {"title": f"День {i+1}", "text": "Свободный день, пей воду"}
-				repo.upsert_meal_day(s2, plan.id, i, d.get("title") or f"День {i+1}", d.get("text") or "...")
-	return plan.id, (today - date.fromisoformat(start_str)).days
\ No newline at end of file
+		rows = {}
+		for i in range(7):
+			d = days[i] if i < len(days) else {"title": f"День {i+1}", "text": "Свободный день, пей воду"}
+			rows[i] = (d.get("title") or f"День {i+1}", d.get("text") or "...")
+		async with async_session_scope() as s2:
+			await async_repo.upsert_meal_days(s2, plan_id, rows)
+	return plan_id, plan_start
\ No newline at end of file
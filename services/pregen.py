@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import NamedTuple
+
+from services.config import settings
+from services.planner import ensure_week_meals, ensure_week_workouts
+from services.timezones import iso_week_start, local_today
+from db.database import async_session_scope
+from db import async_repo
+
+logger = logging.getLogger(__name__)
+
+
+class _PlanOwner(NamedTuple):
+	id: int
+	timezone: str | None
+
+
+async def _pregenerate_for(owner: _PlanOwner) -> None:
+	next_week = iso_week_start(local_today(owner.timezone)) + timedelta(days=7)
+	await ensure_week_workouts(owner, next_week)
+	await ensure_week_meals(owner, next_week)
+
+
+async def pregenerate_next_week() -> None:
+	"""Generate next week's plans for users whose active plans end soon. Resumes from the daily checkpoint."""
+	today = date.today()
+	cutoff = (today + timedelta(days=settings.pregen_lookahead_days)).isoformat()
+	checkpoint = f"pregen:{today.isoformat()}"
+	deadline = time.monotonic() + settings.pregen_max_run_sec
+	sem = asyncio.Semaphore(settings.pregen_concurrency)
+	page_size = max(settings.pregen_concurrency * 4, 1)
+	processed = failed = 0
+
+	async def _one(owner: _PlanOwner) -> None:
+		nonlocal failed
+		async with sem:
+			try:
+				await _pregenerate_for(owner)
+			except Exception as e:
+				failed += 1
+				logger.warning("pregen failed for user %s: %s", owner.id, e)
+
+	async with async_session_scope() as s:
+		after_id = int(await async_repo.get_checkpoint(s, checkpoint) or 0)
+	while processed < settings.pregen_max_users_per_run and time.monotonic() < deadline:
+		limit = min(page_size, settings.pregen_max_users_per_run - processed)
+		async with async_session_scope() as s:
+			owners = [_PlanOwner(u.id, u.timezone) for u in await async_repo.list_users_with_expiring_plans(s, cutoff, after_id, limit)]
+		if not owners:
+			break
+		await asyncio.gather(*(_one(o) for o in owners))
+		processed += len(owners)
+		after_id = owners[-1].id
+		async with async_session_scope() as s:
+			await async_repo.set_checkpoint(s, checkpoint, str(after_id))
+	logger.info("pregen: %s users processed, %s failed, cursor=%s", processed, failed, after_id)
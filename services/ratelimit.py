@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any
+
+
+class TokenBucket:
+	"""Async token bucket: `rate` tokens/s refill up to `capacity`; waiters are served FIFO."""
+
+	def __init__(self, rate: float, capacity: float | None = None) -> None:
+		self.rate = max(rate, 0.001)
+		self.capacity = capacity if capacity is not None else max(rate, 1.0)
+		self._tokens = self.capacity
+		self._updated = time.monotonic()
+		self._blocked_until = 0.0
+		self._lock = asyncio.Lock()
+
+	def _refill(self, now: float) -> None:
+		self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	async def acquire(self, tokens: float = 1.0) -> None:
+		async with self._lock:
+			while True:
+				now = time.monotonic()
+				if now < self._blocked_until:
+					await asyncio.sleep(self._blocked_until - now)
+					continue
+				self._refill(now)
+				if self._tokens >= tokens:
+					self._tokens -= tokens
+					return
+				await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+	def try_acquire(self, tokens: float = 1.0) -> float:
+		"""Take `tokens` now and return 0.0, or take nothing and return the seconds to wait."""
+		now = time.monotonic()
+		if now < self._blocked_until:
+			return self._blocked_until - now
+		self._refill(now)
+		if self._tokens >= tokens:
+			self._tokens -= tokens
+			return 0.0
+		return (tokens - self._tokens) / self.rate
+
+	def pause(self, seconds: float) -> None:
+		"""Hold all acquirers for `seconds` (e.g. after a flood-wait) and drop accumulated burst."""
+		self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+		self._tokens = 0.0
+
+
+def retry_after_seconds(exc: Any, default: float = 1.0) -> float:
+	"""Seconds from telegram.error.RetryAfter (int in PTB 21, timedelta in later versions)."""
+	value = getattr(exc, "retry_after", default)
+	if isinstance(value, timedelta):
+		return value.total_seconds()
+	try:
+		return float(value)
+	except (TypeError, ValueError):
+		return default
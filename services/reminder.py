@@ -1,34 +1,93 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from db.database import session_scope
-from db import repo
+from db.database import async_session_scope
+from db import async_repo
+from services.config import settings
+from services.pregen import pregenerate_next_week
+from services.fanout import FanoutEngine
+from services.outbound import outbound, Priority
+from services.timezones import resolve_tz
 
 logger = logging.getLogger(__name__)
 
 
-def _collect_user_ids() -> list[int]:
-	ids: list[int] = []
-	with session_scope() as s:
-		# naive: everyone in users table
-		from db.models import User
-		for row in s.query(User).all():
-			ids.append(int(row.tg_user_id))
-	return ids
+REMINDER_TEXT = "Напоминание: загляни в тренировки и меню на сегодня ✨"
 
+_engine = FanoutEngine(
+	rate_per_sec=settings.reminder_rate_per_sec,
+	concurrency=settings.reminder_concurrency,
+	page_size=settings.reminder_page_size,
+)
 
-async def send_daily_reminders(bot, hour: int) -> None:
-	user_ids = _collect_user_ids()
-	for uid in user_ids:
-		try:
-			await bot.send_message(chat_id=uid, text="Напоминание: загляни в тренировки и меню на сегодня ✨")
-		except Exception as e:
-			logger.warning("reminder failed for %s: %s", uid, e)
+
+def _due_slot(now_utc: datetime, tz_name: str | None, hour: int) -> tuple[str, int] | None:
+	"""(local date, current jitter slot) if `tz_name` is inside its local reminder window, else None."""
+	local = now_utc.astimezone(resolve_tz(tz_name))
+	start = local.replace(hour=hour, minute=0, second=0, microsecond=0)
+	elapsed_min = (local - start).total_seconds() / 60
+	if not 0 <= elapsed_min < settings.reminder_window_minutes:
+		return None
+	return local.date().isoformat(), int(elapsed_min // settings.reminder_slot_minutes)
+
+
+def _slot_count() -> int:
+	return max(1, settings.reminder_window_minutes // settings.reminder_slot_minutes)
+
+
+async def send_due_reminders(bot, hour: int) -> None:
+	"""Tick: remind every timezone bucket whose local time is inside [hour, hour + window)."""
+	now = datetime.now(timezone.utc)
+	n_slots = _slot_count()
+	async with async_session_scope() as s:
+		buckets = {tz or None for tz in await async_repo.list_user_timezones(s)}
+
+	async def _send(chat_id: int) -> None:
+		await outbound.submit(bot.send_message, priority=Priority.BULK, chat_id=chat_id, text=REMINDER_TEXT)
+
+	for tz_name in sorted(buckets, key=lambda t: t or ""):
+		due = _due_slot(now, tz_name, hour)
+		if due is None:
+			continue
+		local_date, current = due
+		# earlier slots too: they finish instantly from their checkpoint, or catch up after a crash/skipped tick
+		for slot in range(min(current, n_slots - 1) + 1):
+			job = f"reminders:{local_date}:{tz_name or '-'}:{slot}"
+
+			async def _page(after_id: int, limit: int, tz_name: str | None = tz_name, slot: int = slot) -> list[tuple[int, int]]:
+				async with async_session_scope() as s:
+					return await async_repo.list_tz_chat_ids_page(s, tz_name, n_slots, slot, after_id, limit)
+
+			stats = await _engine.run(job, _page, _send)
+			if stats.sent or stats.failed or stats.blocked:
+				logger.info("%s: %s", job, stats.as_dict())
+
+
+async def purge_old_checkpoints() -> None:
+	"""Daily: drop job_checkpoints rows (one per day x timezone x slot, one per pregen day) past retention."""
+	cutoff = (datetime.utcnow() - timedelta(days=settings.job_checkpoint_retention_days)).isoformat()
+	async with async_session_scope() as s:
+		removed = await async_repo.purge_checkpoints(s, cutoff)
+	if removed:
+		logger.info("purged %d job checkpoint(s)", removed)
 
 
 def setup_scheduler(scheduler: AsyncIOScheduler, bot, hour: int) -> None:
-	trigger = CronTrigger(hour=hour, minute=0)
-	scheduler.add_job(send_daily_reminders, trigger=trigger, args=[bot, hour], id="daily_reminders", replace_existing=True)
\ No newline at end of file
+	if settings.feature_reminder:
+		# every slot boundary; each user is due in exactly one slot of their local window
+		trigger = CronTrigger(minute=f"*/{settings.reminder_slot_minutes}")
+		scheduler.add_job(send_due_reminders, trigger=trigger, args=[bot, hour], id="reminders_tick", replace_existing=True, max_instances=1, coalesce=True)
+	if settings.feature_pregen and settings.feature_db:
+		scheduler.add_job(
+			pregenerate_next_week,
+			trigger=CronTrigger(hour=settings.pregen_hours, minute=15),
+			id="pregen_next_week",
+			replace_existing=True,
+			max_instances=1,
+			coalesce=True,
+		)
+	if settings.feature_reminder or (settings.feature_pregen and settings.feature_db):
+		scheduler.add_job(purge_old_checkpoints, trigger=CronTrigger(hour=0, minute=45), id="purge_checkpoints", replace_existing=True, max_instances=1, coalesce=True)
\ No newline at end of file
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+	"""Coalesces concurrent calls with the same key into one in-flight task."""
+
+	def __init__(self) -> None:
+		self._inflight: Dict[Hashable, asyncio.Task] = {}
+		self.started = 0
+		self.coalesced = 0
+
+	async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+		task = self._inflight.get(key)
+		if task is None:
+			self.started += 1
+			task = asyncio.ensure_future(fn())
+			self._inflight[key] = task
+			task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+		else:
+			self.coalesced += 1
+		# shield: a cancelled caller must not cancel the work other callers wait on
+		return await asyncio.shield(task)
+
+	def in_flight(self) -> int:
+		return len(self._inflight)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from services.config import settings
+
+logger = logging.getLogger(__name__)
+
+# "+03:00", "-0530", "UTC+3", "GMT-04:30"
+_OFFSET_RE = re.compile(r"^(?:UTC|GMT)?\s*([+-])(\d{1,2})(?::?(\d{2}))?$", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def resolve_tz(name: str | None) -> tzinfo:
+	raw = (name or "").strip() or settings.default_timezone
+	m = _OFFSET_RE.match(raw)
+	if m:
+		sign = -1 if m.group(1) == "-" else 1
+		delta = timedelta(hours=int(m.group(2)), minutes=int(m.group(3) or 0))
+		if delta < timedelta(hours=15):
+			return timezone(sign * delta)
+	elif raw.upper() in ("UTC", "GMT", "Z"):
+		return timezone.utc
+	else:
+		try:
+			return ZoneInfo(raw)
+		except (ZoneInfoNotFoundError, ValueError, OSError):
+			pass
+	if raw != settings.default_timezone:
+		logger.warning("Unknown timezone %r, using %s", raw, settings.default_timezone)
+		return resolve_tz(settings.default_timezone)
+	return timezone.utc
+
+
+def local_now(tz_name: str | None) -> datetime:
+	return datetime.now(resolve_tz(tz_name))
+
+
+def local_today(tz_name: str | None) -> date:
+	return local_now(tz_name).date()
+
+
+def iso_week_start(day: date) -> date:
+	return day - timedelta(days=day.weekday())
@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict
+
+from services.config import settings
+from services.ttl_cache import TTLCache
+from db.database import async_session_scope
+from db import async_repo
+
+logger = logging.getLogger(__name__)
+
+# file_unique_id is stable across forwards/resends of the same voice note
+_memory: TTLCache[str] = TTLCache(settings.transcript_cache_max_entries, settings.transcript_cache_ttl_sec)
+_db_hits = 0
+_db_misses = 0
+
+
+async def get(file_unique_id: str) -> str | None:
+	global _db_hits, _db_misses
+	text = _memory.get(file_unique_id)
+	if text is not None or not settings.feature_db:
+		return text
+	try:
+		async with async_session_scope() as s:
+			tr = await async_repo.get_transcription_by_unique_id(s, file_unique_id)
+			text = tr.text if tr else None
+	except Exception as e:
+		logger.warning("transcript cache read failed: %s", e)
+		return None
+	if text is None:
+		_db_misses += 1
+		return None
+	_db_hits += 1
+	_memory.set(file_unique_id, text)
+	return text
+
+
+async def put(user_id: int | None, file_id: str, file_unique_id: str, text: str, duration_sec: int | None, format_: str | None) -> None:
+	_memory.set(file_unique_id, text)
+	if not settings.feature_db or user_id is None:
+		return
+	try:
+		async with async_session_scope() as s:
+			await async_repo.add_transcription(s, user_id, file_id, text, duration_sec, format_, telegram_file_unique_id=file_unique_id)
+	except Exception as e:
+		logger.warning("transcript write failed: %s", e)
+
+
+def stats() -> Dict[str, Any]:
+	return {"memory": _memory.stats(), "db_hits": _db_hits, "db_misses": _db_misses}
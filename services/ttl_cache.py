@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+	"""Bounded LRU with per-entry expiry and hit/miss counters. Not thread-safe; event-loop only."""
+
+	def __init__(self, max_size: int, ttl_sec: float) -> None:
+		self.max_size = max(1, max_size)
+		self.ttl_sec = ttl_sec
+		self._data: "OrderedDict[Hashable, tuple[float, V]]" = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key: Hashable) -> Optional[V]:
+		item = self._data.get(key)
+		if item is None:
+			self.misses += 1
+			return None
+		expires_at, value = item
+		if expires_at < time.monotonic():
+			del self._data[key]
+			self.misses += 1
+			return None
+		self._data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def set(self, key: Hashable, value: V, ttl_sec: float | None = None) -> None:
+		ttl = self.ttl_sec if ttl_sec is None else ttl_sec
+		self._data[key] = (time.monotonic() + ttl, value)
+		self._data.move_to_end(key)
+		while len(self._data) > self.max_size:
+			self._data.popitem(last=False)
+			self.evictions += 1
+
+	def invalidate(self, key: Hashable) -> None:
+		self._data.pop(key, None)
+
+	def clear(self) -> None:
+		self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+	def stats(self) -> Dict[str, Any]:
+		total = self.hits + self.misses
+		return {
+			"size": len(self._data),
+			"max_size": self.max_size,
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+			"hit_rate": round(self.hits / total, 3) if total else 0.0,
+		}
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.config import settings
+from db.database import async_session_scope
+
+logger = logging.getLogger(__name__)
+
+WriteOp = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteBehindQueue:
+	"""Buffers non-critical writes and commits them in batches from a background task."""
+
+	def __init__(self, max_size: int, batch_size: int, flush_interval_ms: int) -> None:
+		self.max_size = max_size
+		self.batch_size = max(1, batch_size)
+		self.flush_interval = flush_interval_ms / 1000
+		self._queue: asyncio.Queue[Optional[WriteOp]] = asyncio.Queue(maxsize=max_size)
+		self._task: asyncio.Task | None = None
+		self.written = 0
+		self.failed = 0
+		self.batches = 0
+
+	def start(self) -> None:
+		if self._task is None:
+			self._task = asyncio.create_task(self._run(), name="write-behind")
+
+	async def submit(self, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> None:
+		"""Queue `fn(session, *args, **kwargs)`; waits only when the queue is full."""
+		op = partial(_call_with_session, fn, args, kwargs)
+		if self._task is None:
+			# not running (e.g. scripts): write through
+			await self._write([op])
+			return
+		await self._queue.put(op)
+
+	async def stop(self) -> None:
+		"""Flush everything queued so far and stop the drain task."""
+		if self._task is None:
+			return
+		await self._queue.put(None)
+		await self._task
+		self._task = None
+		rest: List[WriteOp] = []
+		while not self._queue.empty():
+			op = self._queue.get_nowait()
+			if op is not None:
+				rest.append(op)
+		if rest:
+			await self._write(rest)
+
+	async def _run(self) -> None:
+		loop = asyncio.get_running_loop()
+		while True:
+			op = await self._queue.get()
+			if op is None:
+				return
+			batch = [op]
+			deadline = loop.time() + self.flush_interval
+			stopping = False
+			while len(batch) < self.batch_size:
+				timeout = deadline - loop.time()
+				if timeout <= 0:
+					break
+				try:
+					nxt = await asyncio.wait_for(self._queue.get(), timeout)
+				except asyncio.TimeoutError:
+					break
+				if nxt is None:
+					stopping = True
+					break
+				batch.append(nxt)
+			await self._write(batch)
+			if stopping:
+				return
+
+	async def _write(self, batch: List[WriteOp]) -> None:
+		try:
+			async with async_session_scope() as s:
+				for op in batch:
+					await op(s)
+			self.batches += 1
+			self.written += len(batch)
+			return
+		except Exception as e:
+			logger.warning("write-behind batch of %s failed, retrying one by one: %s", len(batch), e)
+		# isolate the failing op so the rest of the batch still lands
+		for op in batch:
+			try:
+				async with async_session_scope() as s:
+					await op(s)
+				self.written += 1
+			except Exception:
+				self.failed += 1
+				logger.exception("write-behind op dropped")
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"queued": self._queue.qsize(),
+			"max_size": self.max_size,
+			"written": self.written,
+			"failed": self.failed,
+			"batches": self.batches,
+		}
+
+
+async def _call_with_session(fn: Callable[..., Awaitable[Any]], args: tuple, kwargs: Dict[str, Any], session: AsyncSession) -> Any:
+	return await fn(session, *args, **kwargs)
+
+
+write_behind = WriteBehindQueue(
+	max_size=settings.write_behind_max_queue,
+	batch_size=settings.write_behind_batch_size,
+	flush_interval_ms=settings.write_behind_flush_ms,
+)